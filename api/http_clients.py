@@ -0,0 +1,67 @@
+from typing import Any, Dict
+
+import httpx
+from loguru import logger
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def create_client(
+    base_url: str,
+    timeout: float,
+    max_connections: int = 100,
+    max_keepalive_connections: int = 20,
+    keepalive_expiry: float = 30.0,
+    http2: bool = True,
+) -> httpx.AsyncClient:
+    """
+    Create a long-lived AsyncClient for one upstream so that connections are pooled
+    and reused across requests instead of doing a new TCP handshake for every call.
+    """
+    http2 = http2 and HTTP2_AVAILABLE
+    logger.info(
+        f"Creating HTTP client for {base_url} with {max_connections=} {max_keepalive_connections=} {timeout=} {http2=}"
+    )
+    return httpx.AsyncClient(
+        base_url=base_url,
+        timeout=httpx.Timeout(timeout),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        http2=http2,
+    )
+
+
+def get_pool_stats(client: httpx.AsyncClient) -> Dict[str, Any]:
+    """
+    Summarize connection pool usage of a client, useful to size the pool limits under load.
+
+    httpx does not expose these numbers publicly so we read them from the underlying
+    httpcore connection pool.
+    """
+    pool = getattr(client._transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    pool_requests = list(getattr(pool, "_requests", []))
+    limits = {
+        "max_connections": getattr(pool, "_max_connections", None),
+        "max_keepalive_connections": getattr(pool, "_max_keepalive_connections", None),
+    }
+
+    n_idle = sum(1 for conn in connections if conn.is_idle())
+    return {
+        "base_url": str(client.base_url),
+        "is_closed": client.is_closed,
+        "connections": len(connections),
+        "active_connections": len(connections) - n_idle,
+        "idle_connections": n_idle,
+        "in_flight_requests": len(pool_requests),
+        "queued_requests": sum(1 for request in pool_requests if request.is_queued()),
+        "limits": limits,
+    }
@@ -16,12 +16,17 @@ def get_sample_id_from_redis(redis_client, key_prefix):
 def custom_openapi(
     app,
     redis_client,
+    redis_output_i2i_pointer_key,
     redis_output_i2i_key_prefix,
     redis_feature_recent_items_key_prefix,
 ):
     if app.openapi_schema:
         return app.openapi_schema
 
+    # Key prefix of the current i2i table, only resolved when the schema is built
+    redis_output_i2i_key_prefix = (
+        redis_client.get(redis_output_i2i_pointer_key) or redis_output_i2i_key_prefix
+    )
     # Fetch sample item_id and user_id from Redis
     sample_item_id = get_sample_id_from_redis(redis_client, redis_output_i2i_key_prefix)
     sample_user_id = get_sample_id_from_redis(
@@ -1,41 +1,52 @@
-import json
 import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
 
-from fastapi import Request
 from loguru import logger
-from starlette.middleware.base import BaseHTTPMiddleware, _StreamingResponse
-from starlette.responses import Response
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Request ID of the request being handled, readable from anywhere down the call stack
+current_rec_id: ContextVar[Optional[str]] = ContextVar("rec_id", default=None)
+
+
+def response_metadata(**metadata: Any) -> Dict[str, Any]:
+    """Response `metadata` including the request ID, for handlers building their payload"""
+    return {**metadata, "rec_id": current_rec_id.get()}
 
 
 # Add middleware to assign request ID
-class RequestIDMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
+class RequestIDMiddleware:
+    """
+    Pure ASGI middleware assigning an ID to every request.
+
+    The ID is returned in the `X-Request-ID` response header and is available to the handlers
+    through `current_rec_id` and `request.state.rec_id`, the response body is passed through
+    untouched.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         rec_id = str(uuid.uuid4())
-        request.state.rec_id = rec_id
-
-        # Contextualize logger with the request ID
-        with logger.contextualize(rec_id=rec_id):
-            response = await call_next(request)
-
-        # Add rec_id to the output response
-        if response.headers.get("Content-Type", "") == "application/json":
-            if isinstance(response, _StreamingResponse):
-                response_body = b""
-                async for chunk in response.body_iterator:
-                    response_body += chunk
-                response_json = json.loads(response_body.decode("utf-8"))
-                if "metadata" in response_json:
-                    response_json["metadata"]["rec_id"] = rec_id
-                else:
-                    response_json["metadata"] = {"rec_id": rec_id}
-
-                modified_response = json.dumps(response_json).encode("utf-8")
-                response.headers["Content-Length"] = str(len(modified_response))
-                return Response(
-                    content=json.dumps(response_json).encode("utf-8"),
-                    status_code=response.status_code,
-                    headers=dict(response.headers),
-                    media_type=response.media_type,
-                )
-
-        return response
+        scope.setdefault("state", {})["rec_id"] = rec_id
+
+        async def send_with_rec_id(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(REQUEST_ID_HEADER, rec_id)
+            await send(message)
+
+        token = current_rec_id.set(rec_id)
+        try:
+            # Contextualize logger with the request ID
+            with logger.contextualize(rec_id=rec_id):
+                await self.app(scope, receive, send_with_rec_id)
+        finally:
+            current_rec_id.reset(token)
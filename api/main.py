@@ -3,67 +3,300 @@ import os
 from typing import List, Optional, Dict, Any
 import asyncio
 import httpx
+import orjson
 import redis
-from fastapi import FastAPI, HTTPException, Query
+import redis.asyncio as aioredis
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse
 from loguru import logger
+from starlette.exceptions import HTTPException as StarletteHTTPException
 import time
 from datetime import datetime
 
 import random
 import sys
+from contextlib import asynccontextmanager
+from .cache import TTLCache
+from .http_clients import create_client, get_pool_stats
 from .load_examples import custom_openapi
-from .logging_utils import RequestIDMiddleware
-from .models import FeatureRequest, FeatureRequestFeature, FeatureRequestResult
-from .utils import debug_logging_decorator
+from .logging_utils import RequestIDMiddleware, response_metadata
+from .rec_codec import decode_recommendations, get_item_id_table_key, is_packed
+from .timings import metrics_response, timed, timings_decorator
+from .models import (
+    BatchRecommendationRequest,
+    FeatureRequest,
+    FeatureRequestFeature,
+    FeatureRequestResult,
+    UserCandidates,
+)
+from .utils import debug_logging_decorator, log_debug, setup_debug_capture
 
-app = FastAPI()
-app.add_middleware(RequestIDMiddleware)
+# Debug messages are still captured per request with debug=true, see utils.debug_logging_decorator
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
 logger.remove()
+# Logs emitted outside of a request, e.g. by the pub/sub listener, have no request ID
+logger.configure(extra={"rec_id": "-"})
 logger.add(
     sys.stderr,
+    level=LOG_LEVEL,
     format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level:<8} | {name}:{function}:{line} | request_id: {extra[rec_id]} - {message}",
 )
+setup_debug_capture(LOG_LEVEL)
 
 MODEL_SERVER_URL = os.getenv("MODEL_SERVER_URL", "http://localhost:3000")
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 100))
 FEAST_ONLINE_SERVER_HOST = os.getenv("FEAST_ONLINE_SERVER_HOST", "localhost")
 FEAST_ONLINE_SERVER_PORT = os.getenv("FEAST_ONLINE_SERVER_PORT", 6566)
 
-seq_url = f"{MODEL_SERVER_URL}/predict"
-redis_client = redis.Redis(host=REDIS_HOST, port=6379, db=0, decode_responses=True)
+# HTTP connection pool configs, shared by all upstream clients
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", 100))
+HTTP_POOL_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("HTTP_POOL_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+HTTP_POOL_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", 30.0))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+# Per-upstream timeouts in seconds
+MODEL_SERVER_TIMEOUT = float(os.getenv("MODEL_SERVER_TIMEOUT", 10.0))
+FEAST_ONLINE_SERVER_TIMEOUT = float(os.getenv("FEAST_ONLINE_SERVER_TIMEOUT", 5.0))
+
+# In-process cache for precomputed recommendations (popular, i2i)
+RECS_CACHE_MAX_SIZE = int(os.getenv("RECS_CACHE_MAX_SIZE", 10_000))
+RECS_CACHE_TTL_SECONDS = float(os.getenv("RECS_CACHE_TTL_SECONDS", 3600))
+# In-process cache for online features per user, short-lived as they change with every rating
+FEATURES_CACHE_MAX_SIZE = int(os.getenv("FEATURES_CACHE_MAX_SIZE", 10_000))
+FEATURES_CACHE_TTL_SECONDS = float(os.getenv("FEATURES_CACHE_TTL_SECONDS", 60))
+# Upper bound on the number of users of one /recs/u2i/rerank/batch request
+BATCH_RECS_MAX_USERS = int(os.getenv("BATCH_RECS_MAX_USERS", 1000))
+
+seq_url = "/predict"
+feast_url = "/get-online-features"
+# Blocking client, only used to look up examples when building the OpenAPI schema
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
 redis_output_i2i_key_prefix = "output:i2i:"
+# Points to the versioned prefix of the latest fully loaded i2i table, see src/redis_loader.py
+redis_output_i2i_pointer_key = "output:pointer:i2i"
 redis_feature_recent_items_key_prefix = "feature:user:recent_items:"
 redis_output_popular_key = "output:popular"
+# The batch pipeline publishes to this channel after it has loaded new outputs
+redis_output_published_channel = "output:published"
+# Clients pushing fresh features of a user to the feature store publish the user id to this channel
+redis_feature_pushed_channel = "feature:user:pushed"
+
+recs_cache = TTLCache(max_size=RECS_CACHE_MAX_SIZE, ttl=RECS_CACHE_TTL_SECONDS)
+features_cache = TTLCache(max_size=FEATURES_CACHE_MAX_SIZE, ttl=FEATURES_CACHE_TTL_SECONDS)
+# Item id tables of the packed i2i lists by version, kept out of recs_cache so that LRU eviction
+# and TTL expiry never drop them, they are only cleared when new outputs are published
+item_id_tables: Dict[int, List[str]] = {}
+
+
+async def listen_for_invalidations(redis_client: aioredis.Redis):
+    """
+    Drop the cached recommendations whenever the batch pipeline publishes a new version, and
+    the cached features of a user whenever fresh ones are pushed to the feature store
+    """
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(
+                    redis_output_published_channel, redis_feature_pushed_channel
+                )
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    if message["channel"].decode("utf-8") == redis_feature_pushed_channel:
+                        user_id = message["data"].decode("utf-8")
+                        log_debug("Fresh features pushed for user {}", user_id)
+                        features_cache.invalidate(user_id)
+                        continue
+                    logger.info(
+                        f"New outputs published ({message['data']}), clearing {len(recs_cache)} cached recommendations"
+                    )
+                    recs_cache.clear()
+                    item_id_tables.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Missed messages are covered by the TTL, try to resubscribe after a while
+            logger.error(
+                f"Subscription to {redis_output_published_channel} and {redis_feature_pushed_channel} failed: {e}"
+            )
+            recs_cache.clear()
+            features_cache.clear()
+            await asyncio.sleep(5)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One long-lived client per upstream so that connections are kept alive and reused
+    pool_kwargs = dict(
+        max_connections=HTTP_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY,
+        http2=HTTP2_ENABLED,
+    )
+    app.state.model_server_client = create_client(
+        MODEL_SERVER_URL, timeout=MODEL_SERVER_TIMEOUT, **pool_kwargs
+    )
+    app.state.feast_client = create_client(
+        f"http://{FEAST_ONLINE_SERVER_HOST}:{FEAST_ONLINE_SERVER_PORT}",
+        timeout=FEAST_ONLINE_SERVER_TIMEOUT,
+        **pool_kwargs,
+    )
+    # Non-blocking Redis client for the request handlers, backed by a shared connection pool
+    # Responses are kept as bytes because precomputed recommendations can be binary packed
+    app.state.redis_client = aioredis.Redis(
+        connection_pool=aioredis.ConnectionPool(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            db=0,
+            decode_responses=False,
+            max_connections=REDIS_MAX_CONNECTIONS,
+        )
+    )
+    invalidation_listener = asyncio.create_task(
+        listen_for_invalidations(app.state.redis_client)
+    )
+    try:
+        yield
+    finally:
+        invalidation_listener.cancel()
+        await app.state.model_server_client.aclose()
+        await app.state.feast_client.aclose()
+        await app.state.redis_client.aclose(close_connection_pool=True)
+
+
+# orjson is much faster than the stdlib json to encode the large recommendation payloads
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(RequestIDMiddleware)
+
+
+@app.exception_handler(StarletteHTTPException)
+async def http_exception_handler(request: Request, exc: StarletteHTTPException):
+    # Error payloads also carry the request ID
+    return ORJSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail, "metadata": response_metadata()},
+        headers=exc.headers,
+    )
 
 # Set the custom OpenAPI schema with examples
 app.openapi = lambda: custom_openapi(
     app,
     redis_client,
+    redis_output_i2i_pointer_key,
     redis_output_i2i_key_prefix,
     redis_feature_recent_items_key_prefix,
 )
 
-def get_recommendations_from_redis(
-    redis_key: str, count: Optional[int]
-) -> Dict[str, Any]:
-    rec_data = redis_client.get(redis_key)
+def parse_recommendations(redis_key: str, rec_data: Optional[bytes]):
     if not rec_data:
         error_message = f"[DEBUG] No recommendations found for key: {redis_key}"
         logger.error(error_message)
         raise HTTPException(status_code=404, detail=error_message)
+    if is_packed(rec_data):
+        # Keep the raw buffer, only the requested entries are decoded when slicing
+        return rec_data
+    # Legacy JSON format
     rec_data_json = json.loads(rec_data)
-    rec_item_ids = rec_data_json.get("rec_item_ids", [])
-    rec_scores = rec_data_json.get("rec_scores", [])
-    if count is not None:
-        rec_item_ids = rec_item_ids[:count]
-        rec_scores = rec_scores[:count]
-    return {"rec_item_ids": rec_item_ids, "rec_scores": rec_scores}
-
-def get_items_from_tag_redis(
+    return {
+        "rec_item_ids": rec_data_json.get("rec_item_ids", []),
+        "rec_scores": rec_data_json.get("rec_scores", []),
+    }
+
+async def get_i2i_key_prefix() -> str:
+    """Resolve the key prefix of the current i2i table, falling back to the legacy unversioned one"""
+    key_prefix = recs_cache.get(redis_output_i2i_pointer_key)
+    if key_prefix is None:
+        key_prefix = await app.state.redis_client.get(redis_output_i2i_pointer_key)
+        key_prefix = (
+            key_prefix.decode("utf-8") if key_prefix else redis_output_i2i_key_prefix
+        )
+        recs_cache.set(redis_output_i2i_pointer_key, key_prefix)
+    return key_prefix
+
+async def get_item_id_table(table_version: int) -> List[str]:
+    item_id_table = item_id_tables.get(table_version)
+    if item_id_table is None:
+        redis_key = get_item_id_table_key(table_version)
+        with timed("redis"):
+            table_data = await app.state.redis_client.get(redis_key)
+        if not table_data:
+            error_message = f"[DEBUG] Item id table not found for key: {redis_key}"
+            logger.error(error_message)
+            raise HTTPException(status_code=500, detail=error_message)
+        item_id_table = json.loads(table_data)
+        item_id_tables[table_version] = item_id_table
+    return item_id_table
+
+async def slice_recommendations(recommendations, count: Optional[int]) -> Dict[str, Any]:
+    if isinstance(recommendations, bytes):
+        table_version, item_indices, rec_scores = decode_recommendations(
+            recommendations, count
+        )
+        item_id_table = await get_item_id_table(table_version)
+        return {
+            "rec_item_ids": [item_id_table[idx] for idx in item_indices],
+            "rec_scores": rec_scores,
+        }
+
+    # Slicing also copies so that callers never mutate the cached lists
+    return {
+        "rec_item_ids": recommendations["rec_item_ids"][:count],
+        "rec_scores": recommendations["rec_scores"][:count],
+    }
+
+async def get_recommendations_from_redis(
+    redis_key: str, count: Optional[int]
+) -> Dict[str, Any]:
+    (recommendations,) = await get_recommendations_from_redis_many([redis_key], count)
+    return recommendations
+
+async def get_recommendations_from_redis_many(
+    redis_keys: List[str], count: Optional[int], return_exceptions: bool = False
+) -> List[Any]:
+    """
+    Fetch several precomputed recommendation lists. Lists found in the in-process cache are
+    served directly, the rest are fetched in one pipelined round trip and then cached.
+
+    With `return_exceptions`, a list that is not found is returned as its HTTPException
+    instead of failing the whole lookup.
+    """
+    recommendations = {key: recs_cache.get(key) for key in redis_keys}
+    missing_keys = [key for key, recs in recommendations.items() if recs is None]
+
+    if missing_keys:
+        with timed("redis"):
+            async with app.state.redis_client.pipeline(transaction=False) as pipe:
+                for redis_key in missing_keys:
+                    pipe.get(redis_key)
+                rec_datas = await pipe.execute()
+        for redis_key, rec_data in zip(missing_keys, rec_datas):
+            try:
+                recs = parse_recommendations(redis_key, rec_data)
+            except HTTPException as e:
+                if not return_exceptions:
+                    raise
+                recommendations[redis_key] = e
+                continue
+            recs_cache.set(redis_key, recs)
+            recommendations[redis_key] = recs
+
+    return [
+        recommendations[key]
+        if isinstance(recommendations[key], HTTPException)
+        else await slice_recommendations(recommendations[key], count)
+        for key in redis_keys
+    ]
+
+async def get_items_from_tag_redis(
     redis_key: str, count: Optional[int] = 100
 ) -> Dict[str, Any]:
-    items = redis_client.smembers(redis_key)
+    items = [
+        item.decode("utf-8") for item in await app.state.redis_client.smembers(redis_key)
+    ]
     if not items:
         error_message = f"[DEBUG] No items found for key: {redis_key}"
         logger.error(error_message)
@@ -71,19 +304,48 @@ def get_items_from_tag_redis(
     random.shuffle(items)
     return {"items": items[:count], "redis_key": redis_key}
 
+def get_rerank_candidates(
+    item_sequence: List[str], *recommendations: Dict[str, Any]
+) -> List[str]:
+    """Merge the retrieved recommendations and remove the items already rated by the user"""
+    all_items = set().union(*(recs["rec_item_ids"] for recs in recommendations))
+    set_item_sequence = set(item_sequence)
+
+    already_rated_items = list(set_item_sequence.intersection(all_items))
+    log_debug(
+        "Removing {} items already rated by this user: {}",
+        len(already_rated_items),
+        already_rated_items,
+    )
+
+    return list(all_items - set_item_sequence)
+
+def sort_by_scores(
+    item_ids: List[str], scores: List[float], count: Optional[int]
+) -> Dict[str, Any]:
+    """Top `count` items sorted by score in descending order"""
+    item_scores = sorted(zip(item_ids, scores), key=lambda x: x[1], reverse=True)[:count]
+    return {
+        "rec_item_ids": [item_id for item_id, _ in item_scores],
+        "rec_scores": [score for _, score in item_scores],
+    }
+
 
 @app.get("/recs/i2i")
 @debug_logging_decorator
+@timings_decorator
 async def get_recommendations_i2i(
     item_id: str = Query(..., description="ID of the item to get recommendations for"),
     count: Optional[int] = Query(10, description="Number of recommendations to return"),
     debug: bool = Query(False, description="Enable debug logging"),
 ):
-    redis_key = f"{redis_output_i2i_key_prefix}{item_id}"
-    recommendations = get_recommendations_from_redis(redis_key, count)
+    with timed("retrieval"):
+        redis_key = f"{await get_i2i_key_prefix()}{item_id}"
+        recommendations = await get_recommendations_from_redis(redis_key, count)
     return {
         "item_id": item_id,
         "recommendations": recommendations,
+        "metadata": response_metadata(),
     }
 
 @app.get(
@@ -91,18 +353,20 @@ async def get_recommendations_i2i(
     summary="Get recommendations for users based on their most recent items",
 )
 @debug_logging_decorator
+@timings_decorator
 async def get_recommendations_u2i_last_item_i2i(
     user_id: str = Query(..., description="ID of the user"),
     count: Optional[int] = Query(10, description="Number of recommendations to return"),
     debug: bool = Query(False, description="Enable debug logging"),
 ):
-    logger.debug(f"Getting recent items for user_id: {user_id}")
+    log_debug("Getting recent items for user_id: {}", user_id)
 
     # Get the recent items for the user
-    item_sequences = await feast_fetch_item_sequence(user_id=user_id)
+    with timed("feature_fetch"):
+        item_sequences = await feast_fetch_item_sequence(user_id=user_id, use_cache=True)
     last_item_id = item_sequences["item_sequence"][-1] # Lastest item
 
-    logger.debug(f"Most recently interacted item: {last_item_id}")
+    log_debug("Most recently interacted item: {}", last_item_id)
 
     # Call the i2i endpoint internally to get recommendations for that item
     recs = await get_recommendations_i2i(last_item_id, count, debug)
@@ -111,12 +375,14 @@ async def get_recommendations_u2i_last_item_i2i(
         "user_id": user_id,
         "last_item_id": last_item_id,
         "recommendations": recs["recommendations"],
+        "metadata": response_metadata(),
     }
 
     return results
 
 @app.get("/recs/u2i/rerank", summary="Get recommendations for users")
 @debug_logging_decorator
+@timings_decorator
 async def get_recommendations_u2i_rerank(
     user_id: str = Query(
         ..., description="ID of the user to provide recommendations for"
@@ -127,41 +393,30 @@ async def get_recommendations_u2i_rerank(
     count: Optional[int] = Query(10, description="Number of recommendations to return"),
     debug: bool = Query(False, description="Enable debug logging"),
 ):
-    # Get popular and i2i recommendations concurrently
-    popular_recs, last_item_i2i_recs = await asyncio.gather(
-        get_recommendations_popular(count=top_k_retrieval, debug=False),
-        get_recommendations_u2i_last_item_i2i(
-            user_id=user_id, count=top_k_retrieval, debug=False
-        )
-    )
-
-    # Merge popular and i2i recommendations
-    all_items = set(popular_recs["recommendations"]["rec_item_ids"]).union(
-        set(last_item_i2i_recs["recommendations"]["rec_item_ids"])
-    )
-    all_items = list(all_items)
-
-    # Get item_sequence_features
-    item_sequences = await feast_fetch_item_sequence(user_id=user_id)
+    # Get item_sequence_features, the most recent item is used for i2i retrieval
+    with timed("feature_fetch"):
+        item_sequences = await feast_fetch_item_sequence(user_id=user_id, use_cache=True)
     item_sequences = item_sequences["item_sequence"]
+    last_item_id = item_sequences[-1]
+    log_debug("Most recently interacted item: {}", last_item_id)
+
+    # Get popular and i2i recommendations in one pipelined round trip
+    with timed("retrieval"):
+        popular_recs, last_item_i2i_recs = await get_recommendations_from_redis_many(
+            [redis_output_popular_key, f"{await get_i2i_key_prefix()}{last_item_id}"],
+            count=top_k_retrieval,
+        )
 
-    # Remove rated items
-    set_item_sequences = set(item_sequences)
-    set_all_items = set(all_items)
-
-    already_rated_items = list(set_item_sequences.intersection(set_all_items))
-    logger.debug(
-        f"Removing {len(already_rated_items)} items already rated by this user: {already_rated_items}"
-    )
-
-    all_items = list(set_all_items - set_item_sequences)
+    with timed("filter"):
+        all_items = get_rerank_candidates(item_sequences, popular_recs, last_item_i2i_recs)
 
     # Rerank
-    reranked_recs = await score_seq_rating_prediction(
-        user_ids=[user_id] * len(all_items),
-        item_sequences=[item_sequences] * len(all_items),
-        item_ids=all_items,
-    )
+    with timed("rerank"):
+        reranked_recs = await score_seq_rating_prediction_user(
+            user_id=user_id,
+            item_sequence=item_sequences,
+            item_ids=all_items,
+        )
 
     # Extract score from the result
     scores = reranked_recs.get("scores", [])
@@ -169,39 +424,165 @@ async def get_recommendations_u2i_rerank(
     reranked_metadata = reranked_recs.get("metadata", {})
     if not scores or len(scores) != len(all_items):
         error_message = "[DEBUG] Mismatch sizes between returned scores and all items"
-        logger.debug(error_message)
+        log_debug(error_message)
         raise HTTPException(status_code=500, detail=error_message)
 
-    # create a list of tuples (item_id, score)
-    item_scores = list(zip(returned_items, scores))
+    with timed("sort"):
+        recommendations = sort_by_scores(returned_items, scores, count)
 
-    # Sort the item based on the scores in descending order
-    item_scores.sort(key=lambda x: x[1], reverse=True)
+    # Return the reranked recommendations
+    with timed("response_build"):
+        result = {
+            "user_id": user_id,
+            "features": {"item_sequence": item_sequences},
+            "recommendations": recommendations,
+            "metadata": response_metadata(rerank=reranked_metadata),
+        }
 
-    # Unzip the sorted items and scores
-    sorted_item_ids, sorted_scores = zip(*item_scores)
+    return result
 
-    # Return the reranked recommendations
-    result = {
-        "user_id": user_id,
-        "features": {"item_sequence": item_sequences},
-        "recommendations": {
-            "rec_item_ids": list(sorted_item_ids)[:count],
-            "rec_scores": list(sorted_scores)[:count],
-        },
-        "metadata": {"rerank": reranked_metadata},
-    }
+@app.post(
+    "/recs/u2i/rerank/batch",
+    summary="Get recommendations for many users at once",
+)
+@debug_logging_decorator
+@timings_decorator
+async def get_recommendations_u2i_rerank_batch(
+    request: BatchRecommendationRequest,
+    debug: bool = Query(False, description="Enable debug logging"),
+):
+    """
+    `/recs/u2i/rerank` for a list of users, with one feature store request, one pipelined Redis
+    round trip and one model server request for the whole batch.
+
+    A user that cannot be served gets an `error` instead of `recommendations` without failing the
+    other users, only the failures of a lookup shared by the batch fail the request.
+    """
+    user_ids = request.user_ids
+    if len(user_ids) > BATCH_RECS_MAX_USERS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {BATCH_RECS_MAX_USERS} users per batch, got {len(user_ids)}",
+        )
+    # Failures of the users that are not served, by position in user_ids
+    errors: Dict[int, HTTPException] = {}
+
+    with timed("feature_fetch"):
+        features = await feast_fetch_item_sequences(user_ids) if user_ids else []
+    item_sequences = [feature["item_sequence"] for feature in features]
+    for idx, item_sequence in enumerate(item_sequences):
+        if not item_sequence:
+            error_message = f"[DEBUG] No item sequence found for user: {user_ids[idx]}"
+            log_debug(error_message)
+            errors[idx] = HTTPException(status_code=404, detail=error_message)
+
+    # Popular and the i2i recommendations of every last item in one pipelined round trip
+    with timed("retrieval"):
+        i2i_key_prefix = await get_i2i_key_prefix()
+        i2i_keys = {
+            idx: f"{i2i_key_prefix}{item_sequence[-1]}"
+            for idx, item_sequence in enumerate(item_sequences)
+            if idx not in errors
+        }
+        redis_keys = list(dict.fromkeys([redis_output_popular_key, *i2i_keys.values()]))
+        retrieved = dict(
+            zip(
+                redis_keys,
+                await get_recommendations_from_redis_many(
+                    redis_keys, count=request.top_k_retrieval, return_exceptions=True
+                ),
+            )
+        )
+    popular_recs = retrieved[redis_output_popular_key]
+    if isinstance(popular_recs, HTTPException):
+        raise popular_recs
+
+    with timed("filter"):
+        candidates: Dict[int, List[str]] = {}
+        for idx, redis_key in i2i_keys.items():
+            last_item_i2i_recs = retrieved[redis_key]
+            if isinstance(last_item_i2i_recs, HTTPException):
+                errors[idx] = last_item_i2i_recs
+                continue
+            candidates[idx] = get_rerank_candidates(
+                item_sequences[idx], popular_recs, last_item_i2i_recs
+            )
+
+    # Rerank the candidates of all the users in one request, one entry per user
+    reranked_recs = {}
+    if candidates:
+        with timed("rerank"):
+            reranked_recs = await score_seq_rating_prediction_users(
+                [
+                    UserCandidates(
+                        user_id=user_ids[idx],
+                        item_sequence=item_sequences[idx],
+                        item_ids=items,
+                    )
+                    for idx, items in candidates.items()
+                ],
+                debug=debug,
+            )
+
+    user_scores = reranked_recs.get("users", [])
+    if len(user_scores) != len(candidates) or any(
+        len(scores["scores"]) != len(items) or len(scores["item_ids"]) != len(items)
+        for scores, items in zip(user_scores, candidates.values())
+    ):
+        error_message = "[DEBUG] Mismatch sizes between returned scores and all items"
+        log_debug(error_message)
+        raise HTTPException(status_code=500, detail=error_message)
+
+    with timed("sort"):
+        recommendations: Dict[int, Dict[str, Any]] = {
+            idx: sort_by_scores(scores["item_ids"], scores["scores"], request.count)
+            for idx, scores in zip(candidates, user_scores)
+        }
+
+    with timed("response_build"):
+        results = []
+        for idx, user_id in enumerate(user_ids):
+            if idx in errors:
+                results.append(
+                    {
+                        "user_id": user_id,
+                        "error": {
+                            "status_code": errors[idx].status_code,
+                            "detail": errors[idx].detail,
+                        },
+                    }
+                )
+                continue
+            results.append(
+                {
+                    "user_id": user_id,
+                    "features": {"item_sequence": item_sequences[idx]},
+                    "recommendations": recommendations[idx],
+                }
+            )
+        result = {
+            "results": results,
+            "metadata": response_metadata(
+                rerank=reranked_recs.get("metadata", {}),
+                n_users=len(user_ids),
+                n_failed=len(errors),
+            ),
+        }
 
     return result
 
 @app.get("/recs/popular")
 @debug_logging_decorator
+@timings_decorator
 async def get_recommendations_popular(
     count: Optional[int] = Query(10, description="Number of popular items to return"),
     debug: bool = Query(False, description="Enable debug logging"),
 ):
-    recommendations = get_recommendations_from_redis(redis_output_popular_key, count)
-    return {"recommendations": recommendations}
+    with timed("retrieval"):
+        recommendations = await get_recommendations_from_redis(
+            redis_output_popular_key, count
+        )
+    return {"recommendations": recommendations, "metadata": response_metadata()}
 
 # New endpoint to connect to external service
 @app.post("/score/seq_rating_prediction")
@@ -212,8 +593,11 @@ async def score_seq_rating_prediction(
     item_ids: List[str],
     debug: bool = Query(False, description="Enable debug logging"),
 ):
-    logger.debug(
-        f"Calling seq_rating_prediction with user_ids: {user_ids}, item_sequences: {item_sequences} and item_ids: {item_ids}"
+    log_debug(
+        "Calling seq_rating_prediction with user_ids: {}, item_sequences: {} and item_ids: {}",
+        user_ids,
+        item_sequences,
+        item_ids,
     )
 
     # Prepare the payload for the model server
@@ -225,13 +609,54 @@ async def score_seq_rating_prediction(
         }
     }
 
-    logger.debug(
-        f"[COLLECT] Payload prepared: <features>{json.dumps(payload)}</features>"
+    return await call_seq_model_server(payload)
+
+
+@app.post("/score/seq_rating_prediction/user")
+@debug_logging_decorator
+async def score_seq_rating_prediction_user(
+    user_id: str,
+    item_sequence: List[str],
+    item_ids: List[str],
+    debug: bool = Query(False, description="Enable debug logging"),
+):
+    """Score many candidate items for one user, the item sequence is only encoded once"""
+    response = await score_seq_rating_prediction_users(
+        [UserCandidates(user_id=user_id, item_sequence=item_sequence, item_ids=item_ids)]
+    )
+    (user_scores,) = response["users"]
+    return {**user_scores, "metadata": response.get("metadata", {})}
+
+
+@app.post("/score/seq_rating_prediction/users")
+@debug_logging_decorator
+async def score_seq_rating_prediction_users(
+    users: List[UserCandidates],
+    debug: bool = Query(False, description="Enable debug logging"),
+):
+    """Score the candidate items of several users, the item sequence of each is encoded once"""
+    log_debug(
+        "Calling seq_rating_prediction for users {} with {} item_ids",
+        lambda: [user.user_id for user in users],
+        lambda: sum(len(user.item_ids) for user in users),
+    )
+
+    # Compact payload: the model server runs the GRU once per user and scores all its candidates
+    payload = {"input_data": {"users": [user.model_dump() for user in users]}}
+
+    return await call_seq_model_server(payload)
+
+
+async def call_seq_model_server(payload: Dict[str, Any]) -> Dict[str, Any]:
+    # Lazy so that the payload is only serialized when a sink takes the DEBUG messages
+    log_debug(
+        "[COLLECT] Payload prepared: <features>{}</features>",
+        lambda: orjson.dumps(payload).decode("utf-8"),
     )
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
+        with timed("model_server"):
+            response = await app.state.model_server_client.post(
                 seq_url,
                 json=payload,
                 headers={
@@ -241,11 +666,11 @@ async def score_seq_rating_prediction(
             )
 
         if response.status_code == 200:
-            logger.debug(
-                f"[COLLECT] Response from external service: <result>{json.dumps(response.json())}</result>"
+            log_debug(
+                "[COLLECT] Response from external service: <result>{}</result>",
+                lambda: response.text,
             )
-            result = response.json()
-            return result
+            return orjson.loads(response.content)
         else:
             error_message = (
                 f"[DEBUG] External service returned an error: {response.text}"
@@ -264,8 +689,8 @@ async def score_seq_rating_prediction(
 
 @app.post("/feast/fetch")
 async def fetch_features(request: FeatureRequest):
-    feast_url = f"http://{FEAST_ONLINE_SERVER_HOST}:{FEAST_ONLINE_SERVER_PORT}/get-online-features"
-    logger.info(f"Sending request to {feast_url}...")
+    feast_client = app.state.feast_client
+    logger.info(f"Sending request to {feast_client.base_url}{feast_url}...")
 
     payload_fresh = {
         "entities": request.entities,
@@ -274,12 +699,17 @@ async def fetch_features(request: FeatureRequest):
     }
 
     # Make the POST request to the feature store
-    async with httpx.AsyncClient() as client:
-        response = await client.post(feast_url, json=payload_fresh)
+    try:
+        with timed("feast"):
+            response = await feast_client.post(feast_url, json=payload_fresh)
+    except httpx.HTTPError as e:
+        error_message = f"[DEBUG] Error connecting to feature store: {str(e)}"
+        logger.error(error_message)
+        raise HTTPException(status_code=500, detail=error_message)
 
     # Check if the request was successful
     if response.status_code == 200:
-        return response.json()
+        return orjson.loads(response.content)
     else:
         raise HTTPException(
             status_code=response.status_code,
@@ -288,7 +718,38 @@ async def fetch_features(request: FeatureRequest):
 
 
 @app.get("/feast/fetch/item_sequence")
-async def feast_fetch_item_sequence(user_id: str):
+async def feast_fetch_item_sequence(
+    user_id: str,
+    use_cache: bool = Query(
+        True, description="Serve the features cached by the API if they are still fresh"
+    ),
+):
+    (item_sequence,) = await feast_fetch_item_sequences([user_id], use_cache=use_cache)
+    return item_sequence
+
+
+async def feast_fetch_item_sequences(
+    user_ids: List[str], use_cache: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    Item sequences of several users. The ones found in the in-process features cache are served
+    directly, the rest are fetched in one request with one entity per user and then cached.
+    """
+    item_sequences = {
+        user_id: features_cache.get(user_id) if use_cache else None for user_id in user_ids
+    }
+    missing_user_ids = [
+        user_id for user_id, item_sequence in item_sequences.items() if item_sequence is None
+    ]
+    if missing_user_ids:
+        for item_sequence in await fetch_item_sequences_from_feast(missing_user_ids):
+            features_cache.set(item_sequence["user_id"], item_sequence)
+            item_sequences[item_sequence["user_id"]] = item_sequence
+    return [item_sequences[user_id] for user_id in user_ids]
+
+
+async def fetch_item_sequences_from_feast(user_ids: List[str]) -> List[Dict[str, Any]]:
+    """Item sequences of several users, fetched in one request with one entity per user"""
     feature_view = "user_rating_stats"
     item_sequence_feature = FeatureRequestFeature(
         feature_view=feature_view, feature_name="user_rating_list_10_recent_asin"
@@ -299,7 +760,7 @@ async def feast_fetch_item_sequence(user_id: str):
     )
 
     feature_req = FeatureRequest(
-        entities={"user_id": [user_id]},
+        entities={"user_id": user_ids},
         features=[
             item_sequence_feature.get_full_name(fresh=True, is_request=True),
             item_sequence_feature.get_full_name(fresh=False, is_request=True),
@@ -311,24 +772,77 @@ async def feast_fetch_item_sequence(user_id: str):
     response = await fetch_features(feature_req)
 
     # Debug: Log response structure
-    logger.debug(f"Feast response keys: {list(response.keys())}")
-    logger.debug(f"Feast response: {response}")
+    log_debug("Feast response keys: {}", lambda: list(response.keys()))
+    log_debug("Feast response: {}", response)
 
     # Feast API always returns "results" key
     if "results" not in response:
         logger.error(f"No 'results' key found in response: {response}")
         raise HTTPException(status_code=500, detail="Invalid Feast API response format")
 
-    logger.info(f"Metadata for result {response['metadata']} with user_id {user_id}")
+    logger.info(f"Metadata for result {response['metadata']} with user_ids {user_ids}")
 
     result = FeatureRequestResult(
         metadata=response["metadata"], results=response["results"]
     )
-    item_sequence = result.get_feature_view(item_sequence_feature)
-    item_sequece_ts = result.get_feature_view(item_sequence_ts_feature)
 
+    # The values of every feature are in the order of the requested entities
+    return [
+        {
+            "user_id": user_id,
+            "item_sequence": result.get_feature_view(item_sequence_feature, entity_index),
+            "item_sequence_ts": result.get_feature_view(
+                item_sequence_ts_feature, entity_index
+            ),
+        }
+        for entity_index, user_id in enumerate(user_ids)
+    ]
+
+
+@app.get("/metrics", summary="Prometheus metrics, including the latency of every endpoint stage")
+async def get_metrics(request: Request):
+    return metrics_response(request.headers.get("accept", ""))
+
+
+@app.get("/stats/http_pools", summary="Connection pool usage of the upstream HTTP clients")
+async def get_http_pool_stats():
     return {
-        "user_id": user_id,
-        "item_sequence": item_sequence,
-        "item_sequence_ts": item_sequece_ts
-    }
\ No newline at end of file
+        "model_server": get_pool_stats(app.state.model_server_client),
+        "feast_online_server": get_pool_stats(app.state.feast_client),
+    }
+
+
+@app.get("/stats/recs_cache", summary="Hit/miss counters of the precomputed recommendations cache")
+async def get_recs_cache_stats():
+    return recs_cache.stats()
+
+
+@app.get("/stats/features_cache", summary="Hit/miss counters of the online features cache")
+async def get_features_cache_stats():
+    return features_cache.stats()
+
+
+@app.post("/cache/recs/invalidate", summary="Drop cached precomputed recommendations")
+async def invalidate_recs_cache(
+    redis_key: Optional[str] = Query(
+        None, description="Only drop this key, drop everything if not provided"
+    ),
+):
+    if redis_key is None:
+        recs_cache.clear()
+    else:
+        recs_cache.invalidate(redis_key)
+    return recs_cache.stats()
+
+
+@app.post("/cache/features/invalidate", summary="Drop cached online features")
+async def invalidate_features_cache(
+    user_id: Optional[str] = Query(
+        None, description="Only drop the features of this user, drop everything if not provided"
+    ),
+):
+    if user_id is None:
+        features_cache.clear()
+    else:
+        features_cache.invalidate(user_id)
+    return features_cache.stats()
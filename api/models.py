@@ -11,6 +11,16 @@ class FeatureRequest(BaseModel):
     entities: Dict[str, List[str]]
     features: List[str]
 
+class BatchRecommendationRequest(BaseModel):
+    user_ids: List[str]
+    top_k_retrieval: int = 100
+    count: int = 10
+
+class UserCandidates(BaseModel):
+    user_id: str
+    item_sequence: List[str]
+    item_ids: List[str]
+
 class FeatureRequestFeature(BaseModel):
     feature_view: str
     feature_name: str
@@ -36,7 +46,8 @@ class FeatureRequestResult(BaseModel):
     metadata: Metadata
     results: List[Result]
 
-    def get_feature_view(self, feature: FeatureRequestFeature):
+    def get_feature_view(self, feature: FeatureRequestFeature, entity_index: int = 0):
+        """Feature value of the `entity_index`-th requested entity, the fresh one if available"""
         # Try to find fresh feature first
         fresh_idx = None
         try:
@@ -57,7 +68,9 @@ class FeatureRequestResult(BaseModel):
 
         # Get the feature value
         feature_results = self.results
-        get_feature_values = lambda idx: feature_results[idx].values[0] if idx is not None else None
+        get_feature_values = (
+            lambda idx: feature_results[idx].values[entity_index] if idx is not None else None
+        )
 
         fresh_value = get_feature_values(fresh_idx)
         if fresh_value is not None:
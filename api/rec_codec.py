@@ -0,0 +1,87 @@
+"""
+Compact binary encoding of precomputed recommendation lists stored in Redis.
+
+Layout (little-endian), version 1:
+
+    header  magic "RC" | format version (uint8) | score dtype (uint8) | table version (uint32) | n (uint32)
+    body    n item indices (int32) followed by n scores (float16 or float32)
+
+Item indices refer to a shared index-to-id table stored as a JSON list under
+`get_item_id_table_key(table_version)`, so the reader can slice the first `count`
+entries without decoding the rest of the buffer.
+
+Only depends on the standard library so that it can be used by both the API and the batch jobs.
+"""
+
+import struct
+from typing import List, Optional, Sequence, Tuple
+
+MAGIC = b"RC"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<2sBBII")
+
+# Score dtype -> (code stored in the header, struct format char)
+SCORE_DTYPES = {
+    "float16": (1, "e"),
+    "float32": (2, "f"),
+}
+SCORE_FORMATS = {code: fmt for code, fmt in SCORE_DTYPES.values()}
+
+ITEM_ID_TABLE_KEY_PREFIX = "output:item_ids:"
+
+
+def get_item_id_table_key(table_version: int) -> str:
+    return f"{ITEM_ID_TABLE_KEY_PREFIX}{table_version}"
+
+
+def encode_recommendations(
+    item_indices: Sequence[int],
+    scores: Sequence[float],
+    table_version: int,
+    score_dtype: str = "float16",
+) -> bytes:
+    if len(item_indices) != len(scores):
+        raise ValueError("item_indices and scores must have the same length")
+    if score_dtype not in SCORE_DTYPES:
+        raise ValueError(f"score_dtype must be one of {list(SCORE_DTYPES)}")
+
+    n = len(item_indices)
+    score_code, score_fmt = SCORE_DTYPES[score_dtype]
+    return b"".join(
+        [
+            HEADER.pack(MAGIC, FORMAT_VERSION, score_code, table_version, n),
+            struct.pack(f"<{n}i", *item_indices),
+            struct.pack(f"<{n}{score_fmt}", *scores),
+        ]
+    )
+
+
+def is_packed(value) -> bool:
+    return isinstance(value, (bytes, bytearray, memoryview)) and bytes(
+        value[: len(MAGIC)]
+    ) == MAGIC
+
+
+def get_table_version(value: bytes) -> int:
+    _, _, _, table_version, _ = HEADER.unpack_from(value)
+    return table_version
+
+
+def decode_recommendations(
+    value: bytes, count: Optional[int] = None
+) -> Tuple[int, List[int], List[float]]:
+    """
+    Returns:
+        (table_version, item_indices, scores) of the first `count` entries
+    """
+    magic, version, score_code, table_version, n = HEADER.unpack_from(value)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported recommendation format {magic!r} v{version}")
+    score_fmt = SCORE_FORMATS[score_code]
+
+    k = n if count is None else max(min(count, n), 0)
+    indices_offset = HEADER.size
+    scores_offset = indices_offset + n * 4
+    item_indices = list(struct.unpack_from(f"<{k}i", value, indices_offset))
+    scores = list(struct.unpack_from(f"<{k}{score_fmt}", value, scores_offset))
+    return table_version, item_indices, scores
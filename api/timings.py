@@ -0,0 +1,104 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest
+from prometheus_client.openmetrics import exposition as openmetrics_exposition
+from starlette.responses import Response
+
+from .logging_utils import current_rec_id
+from .utils import log_debug
+
+STAGE_LATENCY = Histogram(
+    "recsys_api_stage_duration_seconds",
+    "Latency of each stage of the API endpoints",
+    ["endpoint", "stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+
+class RequestTimings:
+    """
+    Request-scoped timing spans of the stages of an endpoint.
+
+    Every span is also observed in the `STAGE_LATENCY` histogram, with the request id as
+    exemplar so that a slow bucket can be traced back to the request logs.
+    """
+
+    def __init__(self, endpoint: str, rec_id: Optional[str] = None):
+        self.endpoint = endpoint
+        self.rec_id = rec_id
+        self.spans: List[Tuple[str, float]] = []
+
+    def record(self, stage: str, seconds: float):
+        self.spans.append((stage, seconds))
+        exemplar = {"rec_id": self.rec_id} if self.rec_id else None
+        STAGE_LATENCY.labels(self.endpoint, stage).observe(seconds, exemplar=exemplar)
+
+    def to_dict(self) -> Dict[str, float]:
+        """Milliseconds spent per stage, summed over the spans of the same stage"""
+        timings: Dict[str, float] = {}
+        for stage, seconds in self.spans:
+            timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+        return {stage: round(ms, 3) for stage, ms in timings.items()}
+
+
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+@contextmanager
+def timed(stage: str):
+    """Time the enclosed block as `stage` of the current request, if any"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = current_timings.get()
+        if timings is not None:
+            timings.record(stage, elapsed)
+        else:
+            STAGE_LATENCY.labels("none", stage).observe(elapsed)
+
+
+def timings_decorator(func: Callable):
+    """
+    Collect the timing spans of the wrapped endpoint, including a `total` span.
+
+    With `debug=True` they are returned in `metadata.timings`. Nested endpoints called
+    internally add their spans to the outermost one.
+    """
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        if current_timings.get() is not None:
+            return await func(*args, **kwargs)
+
+        timings = RequestTimings(func.__name__, rec_id=current_rec_id.get())
+        token = current_timings.set(timings)
+        try:
+            with timed("total"):
+                result = await func(*args, **kwargs)
+        finally:
+            current_timings.reset(token)
+            log_debug("Timings of {}: {}", timings.endpoint, timings.to_dict)
+
+        if kwargs.get("debug", False) and isinstance(result, dict):
+            result.setdefault("metadata", {})["timings"] = timings.to_dict()
+        return result
+
+    return wrapper
+
+
+def metrics_response(accept: str = "") -> Response:
+    # Exemplars are only part of the OpenMetrics exposition format
+    if "application/openmetrics-text" in accept:
+        return Response(
+            openmetrics_exposition.generate_latest(REGISTRY),
+            media_type=openmetrics_exposition.CONTENT_TYPE_LATEST,
+        )
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,41 +1,75 @@
+from contextvars import ContextVar
 from functools import wraps
-from typing import Callable, List
+from typing import Callable, List, Optional
 
 from loguru import logger
 
-def capture_debug_messages(debug_list):
-    def sink(message):
-        record = message.record
-        if record["level"].name == "DEBUG" or record["message"].startswith("[DEBUG]"):
-            debug_list.append(record["message"])
+# Debug messages of the current request, only set for requests made with debug=True
+current_debug_messages: ContextVar[Optional[List[str]]] = ContextVar(
+    "debug_messages", default=None
+)
+_debug_level_enabled = False
 
-    return sink
+
+def capture_debug_messages(message):
+    debug_messages = current_debug_messages.get()
+    if debug_messages is not None:
+        debug_messages.append(message.record["message"])
+
+
+def is_debug_message(record) -> bool:
+    if current_debug_messages.get() is None:
+        return False
+    return record["level"].name == "DEBUG" or record["message"].startswith("[DEBUG]")
+
+
+def setup_debug_capture(log_level: str):
+    """
+    Add the one sink that captures the debug messages of the requests made with debug=True.
+    It is never removed, each message goes to the buffer of the request that logged it.
+    """
+    global _debug_level_enabled
+    _debug_level_enabled = logger.level(log_level).no <= logger.level("DEBUG").no
+    logger.add(capture_debug_messages, level="DEBUG", filter=is_debug_message)
+
+
+def debug_enabled() -> bool:
+    return _debug_level_enabled or current_debug_messages.get() is not None
+
+
+def log_debug(message: str, *args, **kwargs):
+    """
+    `logger.debug` that does nothing, formatting included, unless the current request captures
+    its debug messages or the DEBUG level is enabled. Callable arguments are only evaluated then.
+    """
+    if not debug_enabled():
+        return
+    args = [arg() if callable(arg) else arg for arg in args]
+    kwargs = {key: value() if callable(value) else value for key, value in kwargs.items()}
+    logger.opt(depth=1).debug(message, *args, **kwargs)
 
 
 def debug_logging_decorator(func: Callable):
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        debug_info: List[str] = []
-        sink_id = None
         debug = kwargs.get("debug", False)
+        if not debug or current_debug_messages.get() is not None:
+            # Nested endpoints log into the buffer of the outermost one
+            return await func(*args, **kwargs)
 
-        if debug:
-            # Add a custom sink to capture debug messages
-            sink_id = logger.add(capture_debug_messages(debug_info))
-
+        # Capture the debug messages of this request only
+        debug_info: List[str] = []
+        token = current_debug_messages.set(debug_info)
         try:
             # Execute the wrapped function and store the result
             result = await func(*args, **kwargs)
 
-            # Attach debug information if debug mode is enabled
-            if debug:
-                result["debug_info"] = debug_info
+            # Attach debug information
+            result["debug_info"] = debug_info
 
             return result
 
         finally:
-            # Remove the custom sink after the request is processed
-            if sink_id:
-                logger.remove(sink_id)
+            current_debug_messages.reset(token)
 
     return wrapper
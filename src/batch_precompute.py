@@ -0,0 +1,153 @@
+import json
+import time
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+import torch
+from loguru import logger
+from tqdm.auto import tqdm
+
+# (query_vectors [B, D], limit) -> neighbor item indices for each query
+SearchFn = Callable[[np.ndarray, int], List[List[int]]]
+
+
+def qdrant_search_fn(client, collection_name: str) -> SearchFn:
+    """Neighbor search with one Qdrant batch search request per batch of queries"""
+    from qdrant_client.models import SearchRequest
+
+    def search(query_vectors: np.ndarray, limit: int) -> List[List[int]]:
+        results = client.search_batch(
+            collection_name=collection_name,
+            requests=[
+                SearchRequest(vector=vector.tolist(), limit=limit)
+                for vector in query_vectors
+            ],
+        )
+        return [[point.id for point in points] for points in results]
+
+    return search
+
+
+def faiss_search_fn(index) -> SearchFn:
+    """
+    Neighbor search with a local `src.vector_search.FaissNN` index.
+    The embeddings must have been added in item index order so that FAISS ids are item indices.
+    """
+
+    def search(query_vectors: np.ndarray, limit: int) -> List[List[int]]:
+        _, indices = index.search_batch(query_vectors, k=limit)
+        return [[idx for idx in row if idx != -1] for row in indices.tolist()]
+
+    return search
+
+
+def score_neighbors(
+    embeddings: torch.Tensor, target_items: np.ndarray, neighbors: np.ndarray
+) -> np.ndarray:
+    """
+    Score all (target, neighbor) pairs of a batch with one vectorized dot product.
+    Same as `SkipGram.forward` on the expanded pairs.
+
+    Args:
+        embeddings: Item embedding matrix [n_items + 1, D], the last row being padding
+        target_items: [B]
+        neighbors: [B, K]
+
+    Returns:
+        Sigmoid scores [B, K]
+    """
+    with torch.no_grad():
+        target_embeds = embeddings[torch.as_tensor(target_items)]  # [B, D]
+        neighbor_embeds = embeddings[torch.as_tensor(neighbors)]  # [B, K, D]
+        scores = torch.einsum("bd,bkd->bk", target_embeds, neighbor_embeds)
+        return torch.sigmoid(scores).numpy()
+
+
+def batch_precompute_i2i(
+    item_indices: Sequence[int],
+    embeddings: torch.Tensor,
+    search_fn: SearchFn,
+    idx_to_id: Dict[int, str],
+    output_fp: str,
+    top_K: int = 100,
+    batch_size: int = 256,
+) -> Dict[str, float]:
+    """
+    Compute the top_K i2i recommendations of every item and stream them to `output_fp` in the
+    batch_recs JSONL format: {"target_item", "rec_item_ids", "rec_scores"}.
+
+    Neighbors of a whole batch of items are retrieved with one search call, then re-scored with
+    the item2vec model and sorted by that score.
+
+    Args:
+        item_indices: Items to compute recommendations for
+        embeddings: Item embedding matrix of the SkipGram model, [n_items + 1, D]
+        search_fn: Batched ANN search, see `qdrant_search_fn` and `faiss_search_fn`
+        idx_to_id: Mapping from item index to item id
+        output_fp: Output JSONL file path
+        top_K: Number of recommendations per item
+        batch_size: Number of items per search and scoring batch
+    """
+    embeddings = embeddings.detach().cpu()
+    padding_idx = embeddings.size(0) - 1
+    item_indices = np.asarray(item_indices)
+
+    n_items = 0
+    search_seconds = 0.0
+    score_seconds = 0.0
+    t_start = time.perf_counter()
+
+    with open(output_fp, "w") as f:
+        for start in tqdm(range(0, len(item_indices), batch_size), desc="Batch precompute"):
+            target_items = item_indices[start : start + batch_size]
+            query_vectors = embeddings[torch.as_tensor(target_items)].numpy()
+
+            t0 = time.perf_counter()
+            # One extra neighbor because the item itself is usually returned
+            batch_neighbors = search_fn(query_vectors, top_K + 1)
+            search_seconds += time.perf_counter() - t0
+
+            # Remove self-recommendation then pad into a [B, K] matrix
+            neighbors = np.full((len(target_items), top_K), padding_idx, dtype=np.int64)
+            for row, (target_item, row_neighbors) in enumerate(
+                zip(target_items, batch_neighbors)
+            ):
+                row_neighbors = [n for n in row_neighbors if n != target_item][:top_K]
+                neighbors[row, : len(row_neighbors)] = row_neighbors
+            is_padding = neighbors == padding_idx
+
+            t0 = time.perf_counter()
+            scores = score_neighbors(embeddings, target_items, neighbors)
+            score_seconds += time.perf_counter() - t0
+
+            # Rerank neighbors based on the model scores, padding goes last
+            scores = np.where(is_padding, -np.inf, scores)
+            order = np.argsort(-scores, axis=1, kind="stable")
+            neighbors = np.take_along_axis(neighbors, order, axis=1)
+            scores = np.take_along_axis(scores, order, axis=1)
+            n_valid = (~is_padding).sum(axis=1)
+
+            for target_item, row_neighbors, row_scores, k in zip(
+                target_items, neighbors, scores, n_valid
+            ):
+                rec = {
+                    "target_item": idx_to_id[int(target_item)],
+                    "rec_item_ids": [idx_to_id[int(idx)] for idx in row_neighbors[:k]],
+                    "rec_scores": row_scores[:k].astype(float).tolist(),
+                }
+                f.write(json.dumps(rec) + "\n")
+            n_items += len(target_items)
+
+    elapsed = time.perf_counter() - t_start
+    items_per_second = n_items / elapsed if elapsed > 0 else float("inf")
+    logger.info(
+        f"Precomputed i2i for {n_items:,} items in {elapsed:.2f}s ({items_per_second:,.0f} items/s), "
+        f"search {search_seconds:.2f}s, scoring {score_seconds:.2f}s"
+    )
+    return {
+        "n_items": n_items,
+        "elapsed_seconds": elapsed,
+        "items_per_second": items_per_second,
+        "search_seconds": search_seconds,
+        "score_seconds": score_seconds,
+    }
@@ -1,9 +1,35 @@
+from collections.abc import Sequence
+
 import numpy as np
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, default_collate
+
+
+class ColumnarBatch(Sequence):
+    """
+    Samples sliced column-wise by `__getitems__`. Indexing it still gives the sample dicts, so
+    that the default collate of a DataLoader keeps working, only slower than `collate_fn`.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["user"])
+
+    def __getitem__(self, idx):
+        return {col: values[idx] for col, values in self.columns.items()}
 
 
 class UserItemRatingDFDataset(Dataset):
+    """
+    The columns are converted once at construction into contiguous tensors, so that a sample
+    or a whole batch (with `__getitems__`) is a fancy-index slice instead of pandas lookups.
+
+    Use `collate_fn` in the DataLoader so that the batches built by `__getitems__` are passed
+    through, with the default collate they are split back into samples and collated again.
+    """
+
     def __init__(
         self,
         df,
@@ -19,36 +45,49 @@ class UserItemRatingDFDataset(Dataset):
         self.rating_col = rating_col
         self.timestamp_col = timestamp_col
         self.item_feature = item_feature
+        self._build_tensors()
+
+    def _build_tensors(self):
+        self.users = torch.as_tensor(self.df[self.user_col].to_numpy(copy=True))
+        self.items = torch.as_tensor(self.df[self.item_col].to_numpy(copy=True))
+        self.ratings = torch.as_tensor(self.df[self.rating_col].to_numpy(copy=True))
+        # Dense [N, seq_len] matrices, [N, 0] when the column is missing
+        self.item_sequences = self._to_matrix("item_sequence")
+        self.item_sequence_ts_buckets = self._to_matrix("item_sequence_ts_bucket")
+        if self.item_feature is not None:
+            self.item_features = torch.as_tensor(np.asarray(self.item_feature))
+        else:
+            self.item_features = torch.empty((len(self.df), 0))
+
+    def _to_matrix(self, col: str) -> torch.Tensor:
+        if col not in self.df or len(self.df) == 0:
+            return torch.empty((len(self.df), 0), dtype=torch.long)
+        return torch.as_tensor(np.stack(self.df[col].to_numpy()).astype(np.int64))
 
     def __len__(self):
         return len(self.df)
 
     def __getitem__(self, idx):
-        user = self.df[self.user_col].iloc[idx]
-        item = self.df[self.item_col].iloc[idx]
-        rating = self.df[self.rating_col].iloc[idx]
-        item_sequence = []
-        if "item_sequence" in self.df:
-            item_sequence = self.df["item_sequence"].iloc[idx]
-        item_sequence_ts_bucket = []
-        if "item_sequence_ts_bucket" in self.df:
-            item_sequence_ts_bucket = self.df["item_sequence_ts_bucket"].iloc[idx]
-        item_feature = []
-        if self.item_feature is not None:
-            item_feature = self.item_feature[idx]
         return dict(
-            user=torch.as_tensor(user),
-            item=torch.as_tensor(item),
-            rating=torch.as_tensor(rating),
-            item_sequence=torch.tensor(item_sequence, dtype=torch.long),
-            item_sequence_ts_bucket=torch.tensor(
-                item_sequence_ts_bucket, dtype=torch.long
-            ),
-            item_feature=(
-                torch.as_tensor(item_feature) if item_feature is not None else []
-            ),
+            user=self.users[idx],
+            item=self.items[idx],
+            rating=self.ratings[idx],
+            item_sequence=self.item_sequences[idx],
+            item_sequence_ts_bucket=self.item_sequence_ts_buckets[idx],
+            item_feature=self.item_features[idx],
         )
 
+    def __getitems__(self, indices):
+        # Same as collating the samples of `__getitem__`, with one slice per column
+        return ColumnarBatch(self[torch.as_tensor(indices, dtype=torch.long)])
+
+    @staticmethod
+    def collate_fn(batch):
+        if isinstance(batch, ColumnarBatch):
+            # Already batched by __getitems__
+            return batch.columns
+        return default_collate(batch)
+
 
 class UserItemBinaryDFDataset(UserItemRatingDFDataset):
     def __init__(
@@ -66,3 +105,4 @@ class UserItemBinaryDFDataset(UserItemRatingDFDataset):
         self.rating_col = rating_col
         self.timestamp_col = timestamp_col
         self.item_feature = item_feature
+        self._build_tensors()
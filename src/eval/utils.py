@@ -31,12 +31,8 @@ def create_rec_df(df, idm: IDMapper, user_col="user_id", item_col="parent_asin")
             )
         ),
         **{
-            user_col: lambda df: df["user_indice"].apply(
-                lambda user_indice: idm.get_user_id(user_indice)
-            ),
-            item_col: lambda df: df["recommendation"].apply(
-                lambda item_indice: idm.get_item_id(item_indice)
-            ),
+            user_col: lambda df: idm.indices_to_users(df["user_indice"]),
+            item_col: lambda df: idm.indices_to_items(df["recommendation"]),
         }
     )
 
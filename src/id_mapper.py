@@ -1,40 +1,185 @@
 import json
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+NPY_MAGIC_PREFIX = b"\x93NUMPY"
+
+
+class IdVocab:
+    """
+    One side of the IDMapper: ids in index order, either as Python objects or as an array of
+    utf-8 encoded ids plus the order that sorts them (possibly memory-mapped).
+
+    Lookups on the encoded array are binary searches, the Python list and dict are only built
+    when accessed.
+    """
+
+    def __init__(
+        self,
+        ids: Optional[List[str]] = None,
+        id_to_index: Optional[Dict[str, int]] = None,
+        encoded: Optional[np.ndarray] = None,
+        order: Optional[np.ndarray] = None,
+    ):
+        self._ids = ids
+        self._id_to_index = id_to_index
+        self.encoded = encoded
+        self.order = order
+        self._lookup = None
+        self._table = None
+
+    def __len__(self):
+        if self.encoded is not None:
+            return len(self.encoded)
+        return len(self.ids)
+
+    @property
+    def ids(self) -> List[str]:
+        if self._ids is None:
+            self._ids = np.char.decode(np.asarray(self.encoded), "utf-8").tolist()
+        return self._ids
+
+    @property
+    def id_to_index(self) -> Dict[str, int]:
+        if self._id_to_index is None:
+            self._id_to_index = {id_: idx for idx, id_ in enumerate(self.ids)}
+        return self._id_to_index
+
+    def get_index(self, id_, unknown_index: int) -> int:
+        if self._id_to_index is None and self.encoded is not None:
+            # Avoid building the whole dict for a single lookup
+            return int(self.to_indices([id_], unknown_index)[0])
+        return self.id_to_index.get(id_, unknown_index)
+
+    def get_id(self, index: int, unknown_id: str) -> str:
+        if index < len(self):
+            if self._ids is None and self.encoded is not None:
+                return self.encoded[index].decode("utf-8")
+            return self.ids[index]
+        return unknown_id
+
+    def to_indices(self, ids, unknown_index: int) -> np.ndarray:
+        if self.encoded is not None:
+            return self._search(ids, unknown_index)
+        # Hash table lookup of all the ids at once, -1 for the ids that are not in the mapping
+        if self._lookup is None:
+            self._lookup = pd.Index(self.ids)
+        indices = self._lookup.get_indexer(pd.Index(ids, dtype=object)).astype(np.int64)
+        indices[indices == -1] = unknown_index
+        return indices
+
+    def _search(self, ids, unknown_index: int) -> np.ndarray:
+        keys = encode_ids(ids)
+        if len(self.encoded) == 0 or len(keys) == 0:
+            return np.full(len(keys), unknown_index, dtype=np.int64)
+        pos = np.searchsorted(self.encoded, keys, sorter=self.order)
+        indices = np.asarray(self.order[np.minimum(pos, len(self.order) - 1)], dtype=np.int64)
+        is_known = self.encoded[indices] == keys
+        return np.where(is_known, indices, unknown_index)
+
+    def to_ids(self, indices, unknown_id: str) -> np.ndarray:
+        # Out of range indices are mapped to the unknown id
+        indices = np.asarray(indices, dtype=np.int64)
+        is_known = (indices >= 0) & (indices < len(self))
+        if self.encoded is not None and self._ids is None:
+            ids = np.full(len(indices), unknown_id, dtype=object)
+            known_ids = np.char.decode(np.asarray(self.encoded[indices[is_known]]), "utf-8")
+            ids[is_known] = known_ids.astype(object)
+            return ids
+        if self._table is None:
+            self._table = np.array([*self.ids, unknown_id], dtype=object)
+        return self._table[np.where(is_known, indices, len(self))]
+
+    def to_arrays(self):
+        encoded = self.encoded
+        if encoded is None:
+            encoded = encode_ids(self.ids)
+        order = self.order
+        if order is None:
+            order = np.argsort(encoded, kind="stable")
+        return encoded, order
 
 
 class IDMapper:
+    """
+    Mapping between user/item ids and indices.
+
+    Saved as JSON, or as a compact binary file of sorted id arrays that is memory-mapped on load,
+    so that a model server worker does not parse the mappings or hold Python dicts of them unless
+    they are accessed.
+    """
+
     def __init__(self):
-        self.user_to_index = {}
-        self.index_to_user = []
-        self.item_to_index = {}
-        self.index_to_item = []
+        self.users = IdVocab([], {})
+        self.items = IdVocab([], {})
         self.unknown_user_index = -1
         self.unknown_item_index = -1
 
+    @property
+    def user_to_index(self):
+        return self.users.id_to_index
+
+    @property
+    def index_to_user(self):
+        return self.users.ids
+
+    @property
+    def item_to_index(self):
+        return self.items.id_to_index
+
+    @property
+    def index_to_item(self):
+        return self.items.ids
+
     def fit(self, user_ids, item_ids):
-        self.user_to_index = {user_id: idx for idx, user_id in enumerate(user_ids)}
-        self.index_to_user = list(user_ids)
-        self.item_to_index = {item_id: idx for idx, item_id in enumerate(item_ids)}
-        self.index_to_item = list(item_ids)
-        self.unknown_user_index = len(self.user_to_index)
-        self.unknown_item_index = len(self.item_to_index)
+        self.users = IdVocab(list(user_ids))
+        self.items = IdVocab(list(item_ids))
+        self.unknown_user_index = len(self.users)
+        self.unknown_item_index = len(self.items)
 
     def get_user_index(self, user_id):
-        return self.user_to_index.get(user_id, self.unknown_user_index)
+        return self.users.get_index(user_id, self.unknown_user_index)
 
     def get_item_index(self, item_id):
-        return self.item_to_index.get(item_id, self.unknown_item_index)
+        return self.items.get_index(item_id, self.unknown_item_index)
 
     def get_user_id(self, index):
-        if index < len(self.index_to_user):
-            return self.index_to_user[index]
-        return "unknown_user"
+        return self.users.get_id(index, "unknown_user")
 
     def get_item_id(self, index):
-        if index < len(self.index_to_item):
-            return self.index_to_item[index]
-        return "unknown_item"
+        return self.items.get_id(index, "unknown_item")
+
+    def users_to_indices(self, user_ids) -> np.ndarray:
+        """Bulk `get_user_index` over an array of user ids"""
+        return self.users.to_indices(user_ids, self.unknown_user_index)
+
+    def items_to_indices(self, item_ids) -> np.ndarray:
+        """Bulk `get_item_index` over an array of item ids"""
+        return self.items.to_indices(item_ids, self.unknown_item_index)
+
+    def indices_to_users(self, indices) -> np.ndarray:
+        """Bulk `get_user_id` over an array of user indices"""
+        return self.users.to_ids(indices, "unknown_user")
+
+    def indices_to_items(self, indices) -> np.ndarray:
+        """Bulk `get_item_id` over an array of item indices"""
+        return self.items.to_ids(indices, "unknown_item")
 
     def save(self, filepath):
+        """
+        Save as JSON if `filepath` ends with .json, otherwise in the binary format:
+        the encoded user ids, their sort order, the encoded item ids and their sort order
+        written one after the other as .npy arrays.
+        """
+        if not filepath.endswith(".json"):
+            with open(filepath, "wb") as f:
+                for vocab in (self.users, self.items):
+                    for array in vocab.to_arrays():
+                        np.lib.format.write_array(f, np.asarray(array), allow_pickle=False)
+            return
+
         with open(filepath, "w") as f:
             json.dump(
                 {
@@ -46,26 +191,66 @@ class IDMapper:
                 f,
             )
 
-    def load(self, filepath):
-        with open(filepath, "r") as f:
-            data = json.load(f)
-            self.user_to_index = data["user_to_index"]
-            self.index_to_user = data["index_to_user"]
-            self.item_to_index = data["item_to_index"]
-            self.index_to_item = data["index_to_item"]
-            self.unknown_user_index = len(self.user_to_index)
-            self.unknown_item_index = len(self.item_to_index)
+    def load(self, filepath, mmap: bool = True):
+        """Load either format, the binary one being memory-mapped unless `mmap` is False"""
+        with open(filepath, "rb") as f:
+            is_binary = f.read(len(NPY_MAGIC_PREFIX)) == NPY_MAGIC_PREFIX
+
+        if is_binary:
+            user_ids, user_order, item_ids, item_order = read_arrays(filepath, 4, mmap)
+            self.users = IdVocab(encoded=user_ids, order=user_order)
+            self.items = IdVocab(encoded=item_ids, order=item_order)
+        else:
+            with open(filepath, "r") as f:
+                data = json.load(f)
+            self.users = IdVocab(data["index_to_user"], data["user_to_index"])
+            self.items = IdVocab(data["index_to_item"], data["item_to_index"])
+
+        self.unknown_user_index = len(self.users)
+        self.unknown_item_index = len(self.items)
         return self
 
 
+def encode_ids(ids) -> np.ndarray:
+    return np.array([str(id_).encode("utf-8") for id_ in ids], dtype=bytes)
+
+
+def read_arrays(filepath: str, n_arrays: int, mmap: bool = True) -> List[np.ndarray]:
+    """Read `n_arrays` .npy arrays written one after the other in the same file"""
+    header_readers = {
+        (1, 0): np.lib.format.read_array_header_1_0,
+        (2, 0): np.lib.format.read_array_header_2_0,
+    }
+    arrays = []
+    with open(filepath, "rb") as f:
+        for _ in range(n_arrays):
+            if not mmap:
+                arrays.append(np.lib.format.read_array(f, allow_pickle=False))
+                continue
+            version = np.lib.format.read_magic(f)
+            shape, fortran_order, dtype = header_readers[version](f)
+            offset = f.tell()
+            n_bytes = int(np.prod(shape)) * dtype.itemsize
+            if n_bytes == 0:
+                array = np.empty(shape, dtype=dtype)
+            else:
+                array = np.memmap(
+                    filepath,
+                    dtype=dtype,
+                    mode="r",
+                    offset=offset,
+                    shape=shape,
+                    order="F" if fortran_order else "C",
+                )
+            arrays.append(array)
+            f.seek(offset + n_bytes)
+    return arrays
+
+
 def map_indice(df, idm: IDMapper, user_col="user_id", item_col="parent_asin"):
     return df.assign(
         **{
-            "user_indice": lambda df: df[user_col].apply(
-                lambda user_id: idm.get_user_index(user_id)
-            ),
-            "item_indice": lambda df: df[item_col].apply(
-                lambda item_id: idm.get_item_index(item_id)
-            ),
+            "user_indice": lambda df: idm.users_to_indices(df[user_col]),
+            "item_indice": lambda df: idm.items_to_indices(df[item_col]),
         }
     )
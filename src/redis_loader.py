@@ -0,0 +1,173 @@
+import json
+import time
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import redis
+from loguru import logger
+from tqdm.auto import tqdm
+
+from api.rec_codec import encode_recommendations, get_item_id_table_key
+
+
+def iter_batch_recs(fp: str) -> Iterator[Dict[str, Any]]:
+    """Stream the batch_recs JSONL output of the batch precompute one record at a time"""
+    with open(fp, "r") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def build_item_id_table(fp: str) -> Tuple[List[str], Dict[str, int]]:
+    item_id_table = []
+    item_to_index = {}
+    for rec_data in tqdm(iter_batch_recs(fp), desc="Building item id table"):
+        for item_id in [rec_data["target_item"], *rec_data["rec_item_ids"]]:
+            if item_id not in item_to_index:
+                item_to_index[item_id] = len(item_id_table)
+                item_id_table.append(item_id)
+    return item_id_table, item_to_index
+
+
+def write_in_chunks(
+    r: redis.Redis,
+    items: Iterable[Tuple[str, Any]],
+    chunk_size: int = 1000,
+    use_mset: bool = False,
+    total: Optional[int] = None,
+    desc: str = "Loading into Redis",
+) -> Dict[str, float]:
+    """
+    Write (key, value) pairs to Redis with one round trip per chunk instead of one per key.
+
+    Args:
+        r: Redis client
+        items: Iterable of (key, value)
+        chunk_size: Number of keys sent per round trip
+        use_mset: Send each chunk as one MSET command instead of a pipeline of SETs
+        total: Optional number of items, only used for the progress bar
+    """
+    n_keys = 0
+    t0 = time.perf_counter()
+    with tqdm(total=total, desc=desc, unit="keys") as pbar:
+        for chunk in chunked(items, chunk_size):
+            if use_mset:
+                r.mset(dict(chunk))
+            else:
+                pipe = r.pipeline(transaction=False)
+                for key, value in chunk:
+                    pipe.set(key, value)
+                pipe.execute()
+            n_keys += len(chunk)
+            pbar.update(len(chunk))
+
+    elapsed = time.perf_counter() - t0
+    keys_per_second = n_keys / elapsed if elapsed > 0 else float("inf")
+    logger.info(f"Wrote {n_keys:,} keys in {elapsed:.2f}s ({keys_per_second:,.0f} keys/s)")
+    return {"n_keys": n_keys, "elapsed_seconds": elapsed, "keys_per_second": keys_per_second}
+
+
+def delete_by_prefix(r: redis.Redis, key_prefix: str, chunk_size: int = 1000) -> int:
+    n_deleted = 0
+    for keys in chunked(r.scan_iter(match=key_prefix + "*", count=chunk_size), chunk_size):
+        n_deleted += r.unlink(*keys)
+    return n_deleted
+
+
+def get_prefix_version(prefix: str, key_prefix: str) -> Optional[int]:
+    """Version of a `{key_prefix}{version}:` prefix, None for any other prefix"""
+    version = prefix[len(key_prefix) :].rstrip(":")
+    if prefix.startswith(key_prefix) and version.isdigit() and prefix == f"{key_prefix}{version}:":
+        return int(version)
+    return None
+
+
+def load_batch_recs(
+    r: redis.Redis,
+    fp: str,
+    key_prefix: str = "output:i2i:",
+    pointer_key: Optional[str] = "output:pointer:i2i",
+    published_channel: Optional[str] = "output:published",
+    chunk_size: int = 1000,
+    use_mset: bool = False,
+    packed: bool = True,
+    score_dtype: str = "float16",
+    delete_stale: bool = True,
+) -> Dict[str, Any]:
+    """
+    Bulk load the batch_recs JSONL into Redis.
+
+    When `pointer_key` is set the recs are written under a versioned prefix
+    `{key_prefix}{version}:` and the pointer key is flipped to that prefix only once
+    everything is written, so readers never see a half-loaded table.
+    Without `pointer_key` the keys are overwritten in place under `key_prefix`.
+
+    The version replaced by the flip is kept until the next load, as API workers may still
+    resolve the old pointer from their cache or miss the published message. With `delete_stale`
+    the version before it is deleted instead, its prefix being kept in `{pointer_key}:previous`.
+
+    Returns:
+        Dict with the load version, the prefix written to and throughput stats
+    """
+    version = int(time.time())
+    load_prefix = f"{key_prefix}{version}:" if pointer_key else key_prefix
+
+    if packed:
+        # The table has to be in place before any packed recs referring to it
+        item_id_table, item_to_index = build_item_id_table(fp)
+        r.set(get_item_id_table_key(version), json.dumps(item_id_table))
+        logger.info(f"Stored item id table version {version} with {len(item_id_table):,} items")
+
+    def encode(rec_data):
+        if packed:
+            return encode_recommendations(
+                [item_to_index[item_id] for item_id in rec_data["rec_item_ids"]],
+                rec_data["rec_scores"],
+                table_version=version,
+                score_dtype=score_dtype,
+            )
+        return json.dumps(
+            {
+                "rec_item_ids": rec_data["rec_item_ids"],
+                "rec_scores": rec_data["rec_scores"],
+            }
+        )
+
+    items = (
+        (load_prefix + rec_data["target_item"], encode(rec_data))
+        for rec_data in iter_batch_recs(fp)
+    )
+    stats = write_in_chunks(r, items, chunk_size=chunk_size, use_mset=use_mset)
+
+    previous_prefix = None
+    if pointer_key:
+        previous_prefix = r.getset(pointer_key, load_prefix)
+        if isinstance(previous_prefix, bytes):
+            previous_prefix = previous_prefix.decode("utf-8")
+        logger.info(f"Pointer {pointer_key} flipped from {previous_prefix} to {load_prefix}")
+
+    if published_channel:
+        r.publish(published_channel, load_prefix)
+
+    stale_prefix = None
+    if pointer_key and previous_prefix and previous_prefix != load_prefix:
+        stale_prefix = r.getset(f"{pointer_key}:previous", previous_prefix)
+        if isinstance(stale_prefix, bytes):
+            stale_prefix = stale_prefix.decode("utf-8")
+
+    if delete_stale and stale_prefix and stale_prefix not in (previous_prefix, load_prefix):
+        stale_version = get_prefix_version(stale_prefix, key_prefix)
+        if stale_version is None:
+            # e.g. the bare key_prefix, whose match would also cover every versioned key
+            logger.warning(f"Not deleting {stale_prefix}, it is not a versioned prefix")
+        else:
+            n_deleted = delete_by_prefix(r, stale_prefix, chunk_size=chunk_size)
+            n_deleted += r.unlink(get_item_id_table_key(stale_version))
+            logger.info(f"Deleted {n_deleted:,} keys of the stale version {stale_prefix}")
+
+    return {"version": version, "key_prefix": load_prefix, **stats}
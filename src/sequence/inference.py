@@ -51,17 +51,17 @@ class SequenceModelWrapper(mlflow.pyfunc.PythonModel):
         if not isinstance(model_input, dict):
             # Ref: https://github.com/mlflow/mlflow/issues/11930
             model_input = model_input.to_dict(orient="records")[0]
-        user_indices = [self.idm.get_user_index(id_) for id_ in model_input["user_ids"]]
-        item_indices = [self.idm.get_item_index(id_) for id_ in model_input["item_ids"]]
+
+        if model_input.get("users") is not None:
+            # Compact request: one item sequence and a list of candidates per user
+            return self.predict_users(model_input["users"], sequence_length, padding_value)
+
+        user_indices = self.idm.users_to_indices(model_input["user_ids"])
+        item_indices = self.idm.items_to_indices(model_input["item_ids"])
         item_sequences = []
         for item_sequence in model_input["item_sequences"]:
-            item_sequence = [self.idm.get_item_index(id_) for id_ in item_sequence]
-            padding_needed = sequence_length - len(item_sequence)
-            item_sequence = np.pad(
-                item_sequence,
-                (padding_needed, 0),
-                "constant",
-                constant_values=padding_value,
+            item_sequence = self.pad_item_sequence(
+                item_sequence, sequence_length, padding_value
             )
             item_sequences.append(item_sequence)
         infer_output = self.infer(user_indices, item_sequences, item_indices).tolist()
@@ -70,10 +70,72 @@ class SequenceModelWrapper(mlflow.pyfunc.PythonModel):
             "scores": infer_output,
         }
 
+    def predict_users(self, users, sequence_length=10, padding_value=-1):
+        """
+        Handle the compact request shape:
+            {"users": [{"user_id": str, "item_sequence": List[str], "item_ids": List[str]}]}
+
+        The item sequence of every user is encoded once and scored against all its candidates.
+        """
+        if len(users) == 0:
+            return {"users": []}
+
+        user_indices = self.idm.users_to_indices([user["user_id"] for user in users])
+        item_sequences = [
+            self.pad_item_sequence(user["item_sequence"], sequence_length, padding_value)
+            for user in users
+        ]
+        n_candidates = [len(user["item_ids"]) for user in users]
+        item_indices = self.idm.items_to_indices(
+            [item_id for user in users for item_id in user["item_ids"]]
+        )
+        infer_output = self.infer_users(
+            user_indices, item_sequences, item_indices, n_candidates
+        ).tolist()
+
+        results = []
+        offset = 0
+        for user, n in zip(users, n_candidates):
+            results.append(
+                {
+                    "user_id": user["user_id"],
+                    "item_ids": list(user["item_ids"]),
+                    "scores": infer_output[offset : offset + n],
+                }
+            )
+            offset += n
+        return {"users": results}
+
+    def pad_item_sequence(self, item_sequence, sequence_length=10, padding_value=-1):
+        item_sequence = self.idm.items_to_indices(item_sequence)
+        item_sequence = item_sequence[-sequence_length:]
+        padding_needed = sequence_length - len(item_sequence)
+        return np.pad(
+            item_sequence,
+            (padding_needed, 0),
+            "constant",
+            constant_values=padding_value,
+        )
 
     def infer(self, user_indices, item_sequences, item_indices):
         user_indices = torch.tensor(user_indices)
-        item_sequences = torch.tensor(item_sequences)
+        item_sequences = torch.tensor(np.array(item_sequences))
         item_indices = torch.tensor(item_indices)
-        output = self.model.predict(user_indices, item_sequences, item_indices)
-        return output.view(len(user_indices)).detach().numpy()
\ No newline at end of file
+        with torch.no_grad():
+            output = self.model.predict(user_indices, item_sequences, item_indices)
+        return output.view(len(user_indices)).detach().numpy()
+
+    def infer_users(self, user_indices, item_sequences, item_indices, n_candidates):
+        user_indices = torch.tensor(user_indices)
+        item_sequences = torch.tensor(np.array(item_sequences))
+        item_indices = torch.tensor(item_indices, dtype=torch.long)
+        repeats = torch.tensor(n_candidates)
+        with torch.no_grad():
+            gru_output, embed_user = self.model.encode_user(user_indices, item_sequences)
+            # Repeat the encoded state of every user, not its raw sequence, over its candidates
+            output = self.model.score_candidates(
+                gru_output.repeat_interleave(repeats, dim=0),
+                embed_user.repeat_interleave(repeats, dim=0),
+                item_indices,
+            )
+        return output.view(len(item_indices)).detach().numpy()
@@ -30,23 +30,56 @@ class SequenceModel(nn.Module):
         )
 
     def forward(self, user_ids, target_item, sequence):
+        gru_output, embed_user = self.encode_user(user_ids, sequence)
+        return self.score_candidates(gru_output, embed_user, target_item)
 
+    def encode_user(self, user_ids, sequence):
+        """
+        Run the GRU over the item sequence and look up the user embedding.
+
+        The output only depends on the user side of the input so it can be computed
+        once and reused to score any number of candidate items with `score_candidates`.
+        """
         padding_idx_tensor = torch.tensor(self.item_embedding.padding_idx, device=sequence.device)
         input_seq = torch.where(sequence == -1, padding_idx_tensor, sequence)
-        target_item = torch.where(target_item == -1, padding_idx_tensor, target_item)
 
         embed_seq = self.item_embedding(input_seq)                # [B, seq_len, D]
         _, hs = self.gru(embed_seq)                               # [1, B, D]
         gru_output = hs.squeeze(0)                                # [B, D]
-        embed_target = self.item_embedding(target_item)           # [B, D]
         embed_user = self.user_embeddings(user_ids)               # [B, D]
+        return gru_output, embed_user
+
+    def score_candidates(self, gru_output, embed_user, target_item):
+        """
+        Score candidate items against the user state returned by `encode_user`.
+
+        A user state with a single row ([1, D]) is broadcast across all N candidates.
+        """
+        padding_idx_tensor = torch.tensor(self.item_embedding.padding_idx, device=target_item.device)
+        target_item = torch.where(target_item == -1, padding_idx_tensor, target_item)
+
+        embed_target = self.item_embedding(target_item)           # [N, D]
+        gru_output = gru_output.expand(embed_target.size(0), -1)  # [N, D]
+        embed_user = embed_user.expand(embed_target.size(0), -1)  # [N, D]
         embed_combined = torch.cat((gru_output, embed_target, embed_user), dim=1)
-        outputs = self.fc(embed_combined)                          # [B, 1]
+        outputs = self.fc(embed_combined)                          # [N, 1]
         return outputs
 
     def predict(self, user, item_sequence, target_item):
         return self.forward(user, target_item, item_sequence)
 
+    def predict_candidates(self, user, item_sequence, target_items):
+        """
+        Score N candidate items for one user, running the GRU over the sequence only once.
+
+        Args:
+            user: Tensor with a single user index, shape [1]
+            item_sequence: Tensor with a single item sequence, shape [1, seq_len]
+            target_items: Tensor of candidate item indices, shape [N]
+        """
+        gru_output, embed_user = self.encode_user(user, item_sequence)
+        return self.score_candidates(gru_output, embed_user, target_items)
+
     def recommend(self, users, item_sequences, k, batch_size=128):
         self.eval()
         all_items = torch.arange(self.n_items, device=users.device)
@@ -58,12 +91,13 @@ class SequenceModel(nn.Module):
                 user_batch = users[i : i + batch_size]
                 item_sequence_batch = item_sequences[i : i + batch_size]
 
-                user_batch_expand = user_batch.unsqueeze(1).expand(-1, len(all_items)).reshape(-1)
+                # Encode each user once then repeat the state instead of the raw sequence
+                gru_output, embed_user = self.encode_user(user_batch, item_sequence_batch)
+                gru_output = gru_output.repeat_interleave(len(all_items), dim=0)
+                embed_user = embed_user.repeat_interleave(len(all_items), dim=0)
                 items_batch = all_items.unsqueeze(0).expand(len(user_batch), -1).reshape(-1)
-                item_sequence_batch_expand = item_sequence_batch.unsqueeze(1).repeat(1, len(all_items), 1)
-                item_sequence_batch_expand = item_sequence_batch_expand.view(-1, item_sequence_batch.size(-1))
 
-                batch_scores = self.predict(user_batch_expand, item_sequence_batch_expand, items_batch)
+                batch_scores = self.score_candidates(gru_output, embed_user, items_batch)
                 batch_scores = batch_scores.view(len(user_batch), -1)
 
                 topk_scores, topk_indices = torch.topk(batch_scores, k, dim=1)
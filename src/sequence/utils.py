@@ -1,4 +1,6 @@
 import numpy as np
+import pandas as pd
+
 
 def generate_item_sequences(
     df,
@@ -8,27 +10,71 @@ def generate_item_sequences(
     sequence_length,
     padding=True,
     padding_value=-1,
+    as_arrow=False,
 ):
-    def get_item_sequence(sub_df):
-        sequences = []
-        for i in range(len(sub_df)):
-            # Get item indices up to the current row (excluding the current row)
-            sequence = sub_df.iloc[:i].tolist()[-sequence_length:]
-            if padding:
-                padding_needed = sequence_length - len(sequence)
-                sequence = np.pad(
-                    sequence,
-                    (padding_needed, 0),  # Add padding at the beginning
-                    "constant",
-                    constant_values=padding_value,
-                )
-            sequences.append(sequence)
-        return sequences
+    """
+    Add an `item_sequence` column with, for each row, the last `sequence_length` items the user
+    interacted with before that row by timestamp, left-padded with `padding_value` if `padding`.
+
+    The windows of all the rows are built at once from one flat array of the items sorted by
+    (user, timestamp) instead of slicing every user group row by row.
 
+    Args:
+        as_arrow: Store the sequences as a pyarrow list column instead of Python lists
+    """
     df = df.sort_values(timestamp_col)
-    df["item_sequence"] = df.groupby(user_col, group_keys=True)[item_col].transform(
-        get_item_sequence
-    )
-    df["item_sequence"] = df["item_sequence"].fillna("").apply(list)
+    n_rows = len(df)
+
+    # Stable sort by user so that the items of a user stay in timestamp order
+    user_codes = df.groupby(user_col, sort=False).ngroup().to_numpy()
+    order = np.argsort(user_codes, kind="stable")
+    sorted_codes = user_codes[order]
+    items = df[item_col].to_numpy()[order]
+
+    # Number of previous items of the same user for every row
+    positions = np.arange(n_rows)
+    is_group_start = np.ones(n_rows, dtype=bool)
+    is_group_start[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    group_starts = np.maximum.accumulate(np.where(is_group_start, positions, 0))
+    lengths = np.minimum(positions - group_starts, sequence_length)
+    # Rows with a missing user are dropped by groupby and get an empty sequence
+    lengths[sorted_codes < 0] = 0
+
+    # Left-padded sliding windows [n_rows, sequence_length] over the flat item array
+    window_positions = positions[:, None] - sequence_length + np.arange(sequence_length)
+    is_valid = np.arange(sequence_length)[None, :] >= (sequence_length - lengths)[:, None]
+    windows = np.full((n_rows, sequence_length), padding_value, dtype=items.dtype)
+    windows[is_valid] = items[window_positions[is_valid]]
+
+    # Back to the row order of df
+    inverse = np.empty_like(order)
+    inverse[order] = positions
+    windows = windows[inverse]
+    lengths = lengths[inverse]
+    if not padding:
+        is_valid = is_valid[inverse]
+
+    if as_arrow:
+        import pyarrow as pa
+
+        if padding:
+            values = windows.reshape(-1)
+            offsets = np.arange(n_rows + 1, dtype=np.int64) * sequence_length
+        else:
+            values = windows[is_valid]
+            offsets = np.zeros(n_rows + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+        list_array = pa.LargeListArray.from_arrays(pa.array(offsets), pa.array(values))
+        df["item_sequence"] = pd.Series(
+            pd.arrays.ArrowExtensionArray(list_array), index=df.index
+        )
+    else:
+        sequences = windows.tolist()
+        if not padding:
+            sequences = [
+                sequence[sequence_length - length :]
+                for sequence, length in zip(sequences, lengths.tolist())
+            ]
+        df["item_sequence"] = pd.Series(sequences, index=df.index, dtype=object)
 
     return df
@@ -0,0 +1,216 @@
+import os
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .memmap import MemmapPicklable
+
+
+class CooccurrenceIndex(MemmapPicklable):
+    """
+    Compact CSR (indptr/indices) index of which items shared a basket with which items.
+
+    Row `i` holds the sorted indices of every item that co-occurred with item `i`
+    (including itself). Compared to a dict of Python sets this takes 4 bytes per pair,
+    can be memory-mapped from disk and is shared for free by forked DataLoader workers.
+    """
+
+    INDPTR_FILENAME = "indptr.npy"
+    INDICES_FILENAME = "indices.npy"
+    location_attr = "dp"
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, dp: Optional[str] = None):
+        self.indptr = indptr
+        self.indices = indices
+        # Directory the arrays are memory-mapped from, if any
+        self.dp = dp
+
+    @property
+    def n_items(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def nnz(self) -> int:
+        return len(self.indices)
+
+    def __len__(self):
+        return self.n_items
+
+    def __getitem__(self, item: int) -> np.ndarray:
+        if item >= self.n_items:
+            return self.indices[:0]
+        return self.indices[self.indptr[item] : self.indptr[item + 1]]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(n_items={self.n_items}, nnz={self.nnz})"
+
+    def contains(self, item: int, candidates: np.ndarray) -> np.ndarray:
+        """Vectorized membership check of `candidates` in the row of `item`"""
+        row = self[item]
+        candidates = np.asarray(candidates)
+        if len(row) == 0:
+            return np.zeros(candidates.shape, dtype=bool)
+        pos = np.searchsorted(row, candidates)
+        return row[np.minimum(pos, len(row) - 1)] == candidates
+
+    def contains_pairs(self, items: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """
+        Vectorized membership check of `candidates[k]` in the row of `items[k]` for all k,
+        with a binary search run in lockstep over all the rows.
+        """
+        items = np.asarray(items, dtype=np.int64)
+        candidates = np.asarray(candidates)
+        if self.nnz == 0:
+            return np.zeros(candidates.shape, dtype=bool)
+
+        in_range = items < self.n_items
+        rows = np.where(in_range, items, 0)
+        lo = np.asarray(self.indptr[rows], dtype=np.int64)
+        row_end = np.asarray(self.indptr[rows + 1], dtype=np.int64)
+        lo = np.where(in_range, lo, row_end)
+        hi = row_end.copy()
+        last = self.nnz - 1
+        while True:
+            active = lo < hi
+            if not active.any():
+                break
+            mid = (lo + hi) // 2
+            go_right = self.indices[np.minimum(mid, last)] < candidates
+            lo = np.where(active & go_right, mid + 1, lo)
+            hi = np.where(active & ~go_right, mid, hi)
+        return (lo < row_end) & (self.indices[np.minimum(lo, last)] == candidates)
+
+    def _pair_keys(self) -> np.ndarray:
+        rows = np.repeat(np.arange(self.n_items, dtype=np.int64), np.diff(self.indptr))
+        return (rows << 32) | self.indices.astype(np.int64)
+
+    @classmethod
+    def from_pair_keys(cls, keys: np.ndarray, n_items: int) -> "CooccurrenceIndex":
+        """Build from unique sorted pair keys `(row << 32) | col`"""
+        rows = keys >> 32
+        indices = (keys & 0xFFFFFFFF).astype(np.int32)
+        indptr = np.zeros(n_items + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_items), out=indptr[1:])
+        return cls(indptr, indices)
+
+    @classmethod
+    def from_dict(cls, interacted: Dict[int, Iterable[int]], n_items: Optional[int] = None):
+        builder = CooccurrenceIndexBuilder()
+        for item, others in interacted.items():
+            others = np.fromiter(others, dtype=np.int64)
+            builder.add_keys((np.int64(item) << 32) | others)
+        return builder.build(n_items)
+
+    def save(self, dp: str):
+        os.makedirs(dp, exist_ok=True)
+        np.save(os.path.join(dp, self.INDPTR_FILENAME), self.indptr)
+        np.save(os.path.join(dp, self.INDICES_FILENAME), self.indices)
+
+    @classmethod
+    def load(cls, dp: str, mmap_mode: Optional[str] = "r") -> "CooccurrenceIndex":
+        indptr = np.load(os.path.join(dp, cls.INDPTR_FILENAME), mmap_mode=mmap_mode)
+        indices = np.load(os.path.join(dp, cls.INDICES_FILENAME), mmap_mode=mmap_mode)
+        return cls(indptr, indices, dp=dp if mmap_mode else None)
+
+
+class CooccurrenceIndexBuilder:
+    """Incrementally build a CooccurrenceIndex from baskets in one streaming pass"""
+
+    def __init__(self, base: Optional[CooccurrenceIndex] = None, chunk_size: int = 1_000_000):
+        """
+        Args:
+            base: Existing index whose pairs are kept, e.g. the train index when building the val index
+            chunk_size: Number of buffered pairs before they are deduplicated
+        """
+        self.chunk_size = chunk_size
+        self._chunks: List[np.ndarray] = []
+        self._buffer: List[np.ndarray] = []
+        self._buffered = 0
+        self.n_items = 0
+        if base is not None:
+            self._chunks.append(base._pair_keys())
+            self.n_items = base.n_items
+
+    def add(self, basket: Iterable[int]):
+        basket = np.unique(np.fromiter(basket, dtype=np.int64))
+        if len(basket) == 0:
+            return
+        # An item is considered to have interacted with itself, which helps with negative sampling
+        self.add_keys(((basket[:, None] << 32) | basket[None, :]).reshape(-1))
+
+    def add_sequences(self, tokens: np.ndarray, offsets: np.ndarray, max_pairs: int = 10_000_000):
+        """
+        Vectorized `add` of every sequence of a flat token array, see `TokenizedSequences`.
+        Every pair of positions within a sequence becomes a pair key, duplicates are removed later.
+
+        Sequences are processed in chunks of about `max_pairs` pairs, a sequence of length L
+        producing L^2 of them, so that memory stays bounded whatever the sequence lengths.
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        lengths = np.diff(offsets)
+        cum_pairs = np.zeros(len(offsets), dtype=np.int64)
+        np.cumsum(lengths**2, out=cum_pairs[1:])
+
+        start = 0
+        while start < len(lengths):
+            # Last sequence boundary within max_pairs pairs of the chunk start
+            end = int(np.searchsorted(cum_pairs, cum_pairs[start] + max_pairs, side="right")) - 1
+            if end <= start:
+                # The sequence alone has more pairs, pair a few of its tokens at a time
+                self._add_long_sequence(tokens[offsets[start] : offsets[start + 1]], max_pairs)
+                start += 1
+                continue
+            self._add_sequence_chunk(tokens, offsets[start : end + 1])
+            start = end
+
+    def _add_sequence_chunk(self, tokens: np.ndarray, offsets: np.ndarray):
+        chunk_offsets = offsets - offsets[0]
+        chunk_tokens = np.asarray(tokens[offsets[0] : offsets[-1]], dtype=np.int64)
+        lengths = np.diff(chunk_offsets)
+
+        # Each token is paired with every token of its own sequence
+        seq_of_token = np.repeat(np.arange(len(lengths)), lengths)
+        n_partners = lengths[seq_of_token]
+        rows = np.repeat(chunk_tokens, n_partners)
+        partner_starts = np.repeat(chunk_offsets[:-1][seq_of_token], n_partners)
+        pair_ends = np.cumsum(n_partners)
+        within = np.arange(pair_ends[-1] if len(pair_ends) else 0) - np.repeat(
+            pair_ends - n_partners, n_partners
+        )
+        cols = chunk_tokens[partner_starts + within]
+        self.add_keys((rows << 32) | cols)
+
+    def _add_long_sequence(self, tokens: np.ndarray, max_pairs: int):
+        tokens = np.asarray(tokens, dtype=np.int64)
+        rows_per_chunk = max(1, max_pairs // len(tokens))
+        for row_start in range(0, len(tokens), rows_per_chunk):
+            rows = tokens[row_start : row_start + rows_per_chunk]
+            self.add_keys(((rows[:, None] << 32) | tokens[None, :]).reshape(-1))
+
+    def add_keys(self, keys: np.ndarray):
+        if len(keys) == 0:
+            return
+        self.n_items = max(self.n_items, int(keys.max() >> 32) + 1)
+        self._buffer.append(keys)
+        self._buffered += len(keys)
+        if self._buffered >= self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._chunks.append(np.unique(np.concatenate(self._buffer)))
+            self._buffer = []
+            self._buffered = 0
+        if len(self._chunks) >= 8:
+            # Merge deduplicated chunks so that repeated pairs do not pile up
+            self._chunks = [np.unique(np.concatenate(self._chunks))]
+
+    def build(self, n_items: Optional[int] = None) -> CooccurrenceIndex:
+        self._flush()
+        keys = (
+            np.unique(np.concatenate(self._chunks))
+            if self._chunks
+            else np.empty(0, dtype=np.int64)
+        )
+        n_items = max(n_items or 0, self.n_items)
+        return CooccurrenceIndex.from_pair_keys(keys, n_items)
@@ -8,7 +8,11 @@ import torch.nn as nn
 from loguru import logger
 from torch.distributed import get_rank, get_world_size
 from torch.utils.data import IterableDataset, get_worker_info
-from tqdm.auto import tqdm
+
+from src.utils import select_distinct_negatives
+
+from .cooccurrence import CooccurrenceIndex, CooccurrenceIndexBuilder
+from .sequences import TokenizedSequences
 
 
 class SkipGramDataset(IterableDataset):
@@ -19,72 +23,75 @@ class SkipGramDataset(IterableDataset):
     def __init__(
         self,
         sequences_fp: str,
-        interacted=defaultdict(set),
+        interacted=None,
         item_freq=defaultdict(int),
         window_size=2,
         negative_samples=5,
         id_to_idx=None,
         ddp=False,
+        max_rejection_rounds=10,
+        batch_size=None,
     ):
         """
         Args:
-            sequences_fp (str): File path to the sequences of item indices in jsonl format.
-            interacted_dict (defaultdict(set)): A dictionary that keeps track of the other items that shared the same basket with the target item. Those items are ignored when negative sampling.
+            sequences_fp (str): File path to the sequences of item ids in jsonl format, or path prefix of the pre-tokenized binary sequences created by `src.skipgram.sequences.convert_sequences`.
+            interacted (CooccurrenceIndex): Index that keeps track of the other items that shared the same basket with the target item. Those items are ignored when negative sampling. A dict of sets is also accepted and converted.
             item_freq (defaultdict(int)): A dictionary that keeps track the item frequency. It's used to
             window_size (int): The context window size.
             negative_samples (int): Number of negative samples for each positive pair.
             id_to_idx (dict): Mapper between item id (string) to item index (int)
             ddp (bool): whether we're using DDP for distributed training or not
+            max_rejection_rounds (int): Number of rounds of rejection sampling before falling back to sampling from the explicitly masked distribution.
+            batch_size (int): If set, iterate over whole batches built from about `batch_size` target items at a time instead of one record per target item. Use with `DataLoader(batch_size=None)`.
 
         The reason that interacted_dict and item_freq can be passed into the initialization is that at val dataset creation we want to do negative sampling based on the data from the train set as well.
         """
 
-        assert sequences_fp.endswith(".jsonl")
         self.sequences_fp = sequences_fp
         self.window_size = window_size
         self.negative_samples = negative_samples
         self.ddp = ddp
+        self.max_rejection_rounds = max_rejection_rounds
+        self.batch_size = batch_size
 
         # Convert the input IDs into sequence integer for easier processing
         if id_to_idx is None:
             self.id_to_idx = dict()
-            self.idx_to_id = dict()
         else:
             self.id_to_idx = id_to_idx
-            self.idx_to_id = {v: k for k, v in id_to_idx.items()}
 
-        self.interacted = deepcopy(interacted)
+        if sequences_fp.endswith(".jsonl"):
+            # Parse once, iterating over the dataset then works on the tokens only
+            self.sequences = TokenizedSequences.from_jsonl(sequences_fp, self.id_to_idx)
+        else:
+            # Pre-tokenized with src.skipgram.sequences.convert_sequences
+            self.sequences = TokenizedSequences.load(sequences_fp)
+        self.idx_to_id = {v: k for k, v in self.id_to_idx.items()}
+
+        if interacted is not None and not isinstance(interacted, CooccurrenceIndex):
+            interacted = CooccurrenceIndex.from_dict(interacted)
         self.item_freq = deepcopy(item_freq)
-        self.num_targets = 0  # Counter for number of items in all sequences
+        self.num_targets = len(self.sequences.tokens)  # Number of items in all sequences
+        self.num_sequences = len(self.sequences)
 
         # Keep tracked of which item-pair co-occur in one basket
         # When doing negative sampling we do not consider the other items that the target item has shared basket
         logger.info("Processing sequences to build interaction data...")
-        with open(self.sequences_fp, "r") as f:
-            seq_idx = 0
-            # Wrap the file with tqdm to show progress
-            for line in tqdm(f, desc="Building interactions"):
-                # Parse each line into a Python object
-                seq = json.loads(line)
-
-                for item in seq:
-                    idx = self.id_to_idx.get(item)
-                    if idx is None:
-                        idx = len(self.id_to_idx)
-                        self.id_to_idx[item] = idx
-                        self.idx_to_id[idx] = item
-                    self.num_targets += 1
-
-                seq_idx_set = set([self.id_to_idx[id_] for id_ in seq])
-                for idx in seq_idx_set:
-                    # An item can be considered that it has interacted with itself
-                    # This helps with negative sampling later
-                    self.interacted[idx].update(seq_idx_set)
-                    self.item_freq[idx] += 1
-
-                seq_idx += 1
-
-        self.num_sequences = seq_idx + 1
+        # An item can be considered that it has interacted with itself
+        # This helps with negative sampling later
+        interacted_builder = CooccurrenceIndexBuilder(base=interacted)
+        interacted_builder.add_sequences(self.sequences.tokens, self.sequences.offsets)
+
+        # Item frequency counts the number of sequences an item appears in
+        seq_of_token = np.repeat(
+            np.arange(self.num_sequences, dtype=np.int64), self.sequences.lengths
+        )
+        seq_item_keys = np.unique(
+            (seq_of_token << 32) | np.asarray(self.sequences.tokens, dtype=np.int64)
+        )
+        seq_item_freq = np.bincount(seq_item_keys & 0xFFFFFFFF)
+        for idx in np.flatnonzero(seq_item_freq):
+            self.item_freq[int(idx)] += int(seq_item_freq[idx])
 
         # Total number of unique items
         if id_to_idx is None:
@@ -93,7 +100,10 @@ class SkipGramDataset(IterableDataset):
             # Need to check this because sometimes the id_to_idx can have more items than the item_freq
             # For example quen previously we filter out sequence length = 1 so there might be some items
             # are excluded
-            self.vocab_size = len(id_to_idx)
+            self.vocab_size = len(self.id_to_idx)
+
+        self.interacted = interacted_builder.build(n_items=self.vocab_size)
+        logger.info(f"Built co-occurrence index {self.interacted}")
 
         # Create a list of items and corresponding probabilities for sampling
         items, frequencies = zip(*self.item_freq.items())
@@ -107,21 +117,37 @@ class SkipGramDataset(IterableDataset):
         self.sampling_probs = self.item_freq_array**0.75
         self.sampling_probs /= self.sampling_probs.sum()
 
+        # Cumulative distribution used to draw negatives with a binary search instead of
+        # renormalizing the full vocab-size probability vector for every sample
+        self.sampling_cdf = np.cumsum(self.sampling_probs)
+        self.sampling_cdf /= self.sampling_cdf[-1]
+
+        # Probability mass of the items that each item has interacted with, used to size the rejection rounds
+        interacted_rows = np.repeat(
+            np.arange(self.interacted.n_items), np.diff(self.interacted.indptr)
+        )
+        self.excluded_mass = np.bincount(
+            interacted_rows,
+            weights=self.sampling_probs[self.interacted.indices],
+            minlength=self.vocab_size,
+        )
+
     def get_process_info(self):
         """
         Get information about which process is processing the data so that we can correctly split up the data based on iteration
-        """
-        if not self.ddp:
-            num_replicas = 1
-            rank = 0
-            return num_replicas, rank
 
+        DataLoader workers always get their own shard, DDP ranks only when `ddp` is set.
+        """
         worker_info = get_worker_info()
         num_workers = worker_info.num_workers if worker_info is not None else 1
         worker_id = worker_info.id if worker_info is not None else 0
 
-        world_size = get_world_size()
-        process_rank = get_rank()
+        if self.ddp:
+            world_size = get_world_size()
+            process_rank = get_rank()
+        else:
+            world_size = 1
+            process_rank = 0
 
         num_replicas = num_workers * world_size
         rank = process_rank * num_workers + worker_id
@@ -130,20 +156,78 @@ class SkipGramDataset(IterableDataset):
 
     def __iter__(self):
         num_replicas, rank = self.get_process_info()
-        with open(self.sequences_fp, "r") as f:
-            idx = 0
-            for line in f:
-                seq = json.loads(line)
-                for i in range(len(seq)):
-                    if idx % num_replicas != rank:
-                        idx += 1
-                        continue
-
-                    yield self._get_item(seq, i)
-                    idx += 1
+        # Contiguous range of sequences so that each replica only reads its own slice of the tokens
+        start, end = self.sequences.shard_bounds(num_replicas, rank)
+        sequence_ids = range(start, end)
+        if self.batch_size:
+            yield from self._iter_batches(sequence_ids)
+            return
+
+        for k in sequence_ids:
+            seq = self.sequences[k]
+            for i in range(len(seq)):
+                yield self._get_item(seq, i)
+
+    def _iter_batches(self, sequence_ids):
+        chunk = []
+        n_tokens = 0
+        for k in sequence_ids:
+            seq = self.sequences[k]
+            chunk.append(seq)
+            n_tokens += len(seq)
+            if n_tokens >= self.batch_size:
+                yield self._build_batch(chunk)
+                chunk = []
+                n_tokens = 0
+        if chunk:
+            yield self._build_batch(chunk)
+
+    def _build_batch(self, sequences):
+        """
+        Build the positive and negative pairs of a chunk of sequences at once.
+
+        Same pairs as `_get_item` over every position of the sequences, except that all the
+        positive pairs of the batch come before all the negative pairs.
+        """
+        lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+        tokens = np.concatenate(sequences).astype(np.int64)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        # Window extraction: every position against every offset within the window
+        seq_of_token = np.repeat(np.arange(len(lengths)), lengths)
+        positions = np.arange(len(tokens))
+        shifts = np.array(
+            [d for d in range(-self.window_size, self.window_size + 1) if d != 0],
+            dtype=np.int64,
+        )
+        context_positions = positions[:, None] + shifts[None, :]  # [T, 2 * window_size]
+        is_valid = (context_positions >= offsets[seq_of_token][:, None]) & (
+            context_positions < offsets[seq_of_token + 1][:, None]
+        )
+        # Row-major masking keeps the pairs ordered by target position then context position
+        target_positions = np.broadcast_to(positions[:, None], context_positions.shape)[is_valid]
+        positive_targets = tokens[target_positions]
+        positive_contexts = tokens[context_positions[is_valid]]
+
+        # One group of negatives per positive pair
+        negative_items = self.sample_negatives_batch(positive_targets)
+        negative_targets = np.repeat(positive_targets, self.negative_samples)
+
+        n_positives = len(positive_targets)
+        labels = np.zeros(n_positives + len(negative_targets), dtype=np.float32)
+        labels[:n_positives] = 1
+
+        return {
+            "target_items": torch.from_numpy(np.concatenate([positive_targets, negative_targets])),
+            "context_items": torch.from_numpy(
+                np.concatenate([positive_contexts, negative_items.reshape(-1)])
+            ),
+            "labels": torch.from_numpy(labels),
+        }
 
     def _get_item(self, sequence, i):
-        sequence = [self.id_to_idx[item] for item in sequence]
+        sequence = sequence.tolist()
         target_item = sequence[i]
 
         positive_pairs = []
@@ -158,30 +242,13 @@ class SkipGramDataset(IterableDataset):
                 positive_pairs.append((target_item, context_item))
                 labels.append(1)  # Positive label
 
-        # Generate negative samples based on item frequency
+        # Generate negative samples based on item frequency, one group per positive pair
         negative_pairs = []
+        negative_items = self.sample_negatives(target_item, len(positive_pairs))
 
-        for target_item, _ in positive_pairs:
-            # Mask out the items that the target item has interacted with
-            # Then sample the remaining items based on the item frequency as negative items
-            negative_sampling_probs = deepcopy(self.sampling_probs)
-            negative_sampling_probs[list(self.interacted[target_item])] = 0
-            if negative_sampling_probs.sum() == 0:
-                # This target_item has interacted with every other items
-                negative_sampling_probs = np.ones(len(negative_sampling_probs))
-
-            negative_sampling_probs /= negative_sampling_probs.sum()
-
-            negative_items = np.random.choice(
-                self.items,
-                size=self.negative_samples,
-                p=negative_sampling_probs,
-                replace=False,
-            )
-
-            for negative_item in negative_items:
-                negative_pairs.append((target_item, negative_item))
-                labels.append(0)
+        for negative_item in negative_items.reshape(-1):
+            negative_pairs.append((target_item, negative_item))
+            labels.append(0)
 
         # Combine positive and negative pairs
         pairs = positive_pairs + negative_pairs
@@ -197,6 +264,82 @@ class SkipGramDataset(IterableDataset):
             "labels": labels,
         }
 
+    def get_interacted(self, target_item) -> np.ndarray:
+        return self.interacted[target_item]
+
+    def sample_negatives(self, target_item, n_groups=1) -> np.ndarray:
+        """
+        Sample `n_groups` groups of `negative_samples` distinct negative items for the target item.
+
+        Returns:
+            np.ndarray of shape [n_groups, negative_samples]
+        """
+        return self.sample_negatives_batch(np.full(n_groups, target_item, dtype=np.int64))
+
+    def sample_negatives_batch(self, target_items) -> np.ndarray:
+        """
+        Sample one group of `negative_samples` distinct negative items for each target item.
+
+        Items are drawn from the smoothed frequency distribution by inverse CDF sampling and
+        the ones that have interacted with their target item (or repeat within a group) are
+        rejected, which is equivalent to sampling without replacement from the distribution
+        renormalized over the non-interacted items, without the O(vocab) work per sample.
+        All the rows still missing items are resampled together in each round.
+
+        Returns:
+            np.ndarray of shape [len(target_items), negative_samples]
+        """
+        n = self.negative_samples
+        target_items = np.asarray(target_items, dtype=np.int64)
+        chosen = np.full((len(target_items), n), -1, dtype=np.int64)
+        pending = np.arange(len(target_items))
+
+        for _ in range(self.max_rejection_rounds):
+            if len(pending) == 0:
+                break
+            targets = target_items[pending]
+            # Expect to reject the excluded share of the probability mass, draw a bit more than that
+            excluded_mass = self.excluded_mass[targets].max()
+            draws_per_round = int(np.ceil(n / max(1.0 - excluded_mass, 0.05))) + 2
+
+            candidates = self._draw_items((len(pending), draws_per_round))
+            is_valid = ~self.interacted.contains_pairs(
+                np.broadcast_to(targets[:, None], candidates.shape), candidates
+            )
+
+            chosen[pending], n_chosen = select_distinct_negatives(
+                chosen[pending], candidates, is_valid, np.full(len(pending), n)
+            )
+            pending = pending[n_chosen < n]
+
+        for row in pending:
+            # Rare case: most of the probability mass is excluded for this target item
+            chosen[row] = self._sample_negatives_masked(self.get_interacted(target_items[row]))
+
+        return chosen
+
+    def _draw_items(self, size) -> np.ndarray:
+        draws = np.searchsorted(self.sampling_cdf, np.random.random(size), side="right")
+        return np.minimum(draws, self.vocab_size - 1)
+
+    def _sample_negatives_masked(self, excluded: np.ndarray) -> np.ndarray:
+        # Mask out the items that the target item has interacted with
+        # Then sample the remaining items based on the item frequency as negative items
+        negative_sampling_probs = self.sampling_probs.copy()
+        negative_sampling_probs[excluded] = 0
+        if negative_sampling_probs.sum() == 0:
+            # This target_item has interacted with every other items
+            negative_sampling_probs = np.ones(len(negative_sampling_probs))
+
+        negative_sampling_probs /= negative_sampling_probs.sum()
+
+        return np.random.choice(
+            self.items,
+            size=self.negative_samples,
+            p=negative_sampling_probs,
+            replace=np.count_nonzero(negative_sampling_probs) < self.negative_samples,
+        )
+
     def collate_fn(self, batch):
         target_items = []
         context_items = []
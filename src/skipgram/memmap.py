@@ -0,0 +1,21 @@
+class MemmapPicklable:
+    """
+    Mixin pickling only the location of memory-mapped arrays, so that worker processes map the
+    same files from disk instead of receiving a copy of the data.
+
+    Subclasses set `location_attr` to the name of the attribute holding the location given to
+    their `load` classmethod, which is None when the arrays are held in memory.
+    """
+
+    location_attr: str
+
+    def __getstate__(self):
+        location = getattr(self, self.location_attr)
+        if location is not None:
+            return {self.location_attr: location}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if set(state) == {self.location_attr}:
+            state = self.load(state[self.location_attr]).__dict__
+        self.__dict__.update(state)
@@ -0,0 +1,93 @@
+import json
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from tqdm.auto import tqdm
+
+from .memmap import MemmapPicklable
+
+
+class TokenizedSequences(MemmapPicklable):
+    """
+    Pre-tokenized item sequences stored as a flat int32 token array plus an int64 offsets array,
+    sequence `k` being `tokens[offsets[k] : offsets[k + 1]]`.
+
+    Saved as `{prefix}.tokens.npy` and `{prefix}.offsets.npy` so that they can be memory-mapped
+    and iterated over without any parsing.
+    """
+
+    TOKENS_SUFFIX = ".tokens.npy"
+    OFFSETS_SUFFIX = ".offsets.npy"
+    location_attr = "prefix"
+
+    def __init__(self, tokens: np.ndarray, offsets: np.ndarray, prefix: Optional[str] = None):
+        self.tokens = tokens
+        self.offsets = offsets
+        # Path prefix the arrays are memory-mapped from, if any
+        self.prefix = prefix
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, k: int) -> np.ndarray:
+        return self.tokens[self.offsets[k] : self.offsets[k + 1]]
+
+    def shard_bounds(self, num_replicas: int, rank: int) -> Tuple[int, int]:
+        """
+        Contiguous range of sequences `[start, end)` of shard `rank` out of `num_replicas`.
+
+        Shards are split on sequence boundaries to hold about the same number of tokens each,
+        together they cover every sequence exactly once.
+        """
+        n_tokens = int(self.offsets[-1])
+        token_bounds = [n_tokens * r // num_replicas for r in (rank, rank + 1)]
+        start, end = np.searchsorted(self.offsets[:-1], token_bounds, side="left")
+        if rank == num_replicas - 1:
+            end = len(self)
+        return int(start), int(end)
+
+    @classmethod
+    def from_jsonl(cls, jsonl_fp: str, id_to_idx: Dict[str, int]) -> "TokenizedSequences":
+        """
+        Parse a JSONL file of item id sequences into tokens.
+
+        Args:
+            jsonl_fp: One JSON list of item ids per line
+            id_to_idx: Mapper from item id to item index. Unknown item ids are added to it
+                with the next available index.
+        """
+        tokens = []
+        offsets = [0]
+        with open(jsonl_fp, "r") as f:
+            for line in tqdm(f, desc="Tokenizing sequences"):
+                for item in json.loads(line):
+                    idx = id_to_idx.get(item)
+                    if idx is None:
+                        idx = len(id_to_idx)
+                        id_to_idx[item] = idx
+                    tokens.append(idx)
+                offsets.append(len(tokens))
+        return cls(np.array(tokens, dtype=np.int32), np.array(offsets, dtype=np.int64))
+
+    def save(self, prefix: str):
+        np.save(prefix + self.TOKENS_SUFFIX, self.tokens)
+        np.save(prefix + self.OFFSETS_SUFFIX, self.offsets)
+
+    @classmethod
+    def load(cls, prefix: str, mmap_mode: Optional[str] = "r") -> "TokenizedSequences":
+        tokens = np.load(prefix + cls.TOKENS_SUFFIX, mmap_mode=mmap_mode)
+        offsets = np.load(prefix + cls.OFFSETS_SUFFIX, mmap_mode=mmap_mode)
+        return cls(tokens, offsets, prefix=prefix if mmap_mode else None)
+
+
+def convert_sequences(
+    jsonl_fp: str, prefix: str, id_to_idx: Dict[str, int]
+) -> TokenizedSequences:
+    """One-time conversion of a JSONL sequences file into the memory-mappable binary format"""
+    sequences = TokenizedSequences.from_jsonl(jsonl_fp, id_to_idx)
+    sequences.save(prefix)
+    return TokenizedSequences.load(prefix)
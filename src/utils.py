@@ -2,6 +2,7 @@ from tqdm.auto import tqdm
 import pandas as pd
 from typing import List
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 def parse_dt(df, cols=["timestamp"]):
     return df.assign(
@@ -24,20 +25,28 @@ def generate_negative_samples(
     neg_to_pos_ratio=1,
     seed=None,
     features: List[str] = [],
+    n_jobs: int = 1,
+    chunk_size: int = 100_000,
 ):
-    # Set the random seed if provided for reproducibility.
-    if seed is not None:
-        np.random.seed(seed)
-
+    """
+    Generate `neg_to_pos_ratio` negative items for every row of df, sampled without replacement
+    proportionally to the item popularity among the items the user has not interacted with.
+
+    Candidates of all the rows are drawn in bulk by inverse CDF sampling and the ones that collide
+    with the user's positive items (looked up in a sorted array of user-item keys) or repeat within
+    a row are rejected then redrawn, so no per-row set difference over the catalog is needed.
+
+    Args:
+        seed: Random seed, the output only depends on it and on `chunk_size`, not on `n_jobs`
+        n_jobs: Number of processes sampling chunks of rows in parallel
+        chunk_size: Number of rows per chunk
+    """
     # Calculate item popularity based on how frequently they appear in the DataFrame.
     item_popularity = df[item_col].value_counts()
 
     # Define all unique items from the DataFrame.
     items = item_popularity.index.values
-    all_items_set = set(items)
-
-    # Create a dictionary mapping each user to the set of items they interacted with.
-    user_item_dict = df.groupby(user_col)[item_col].apply(set).to_dict()
+    n_items = len(items)
 
     # Prepare popularity values for sampling probabilities.
     popularity = item_popularity.values.astype(np.float64)
@@ -46,55 +55,62 @@ def generate_negative_samples(
     total_popularity = popularity.sum()
     if total_popularity == 0:
         # Handle edge case where no items have popularity by using uniform distribution.
-        sampling_probs = np.ones(len(items)) / len(items)
+        sampling_probs = np.ones(n_items) / n_items
     else:
         sampling_probs = popularity / total_popularity
 
-    # Create a mapping from item to index to quickly access item-related data.
-    item_to_index = {item: idx for idx, item in enumerate(items)}
-
-    def generate_negative_samples_for_user(row):
-        user = row[user_col]
-        pos_items = user_item_dict[user]
-
-        # Identify items not interacted with by the user (negative candidates).
-        negative_candidates = all_items_set - pos_items
-        num_neg_candidates = len(negative_candidates)
-
-        if num_neg_candidates == 0:
-            # If the user interacted with all items, skip this user.
-            return []
-
-        # The number of negative samples to generate equals the number of positive interactions, or fewer if there aren't enough candidates.
-        num_neg = min(neg_to_pos_ratio, num_neg_candidates)
-
-        # Convert the set of negative candidates to a list for indexing.
-        negative_candidates_list = list(negative_candidates)
-
-        # Obtain the indices and probabilities for the negative candidates.
-        candidate_indices = [item_to_index[item] for item in negative_candidates_list]
-        candidate_probs = sampling_probs[candidate_indices]
-        candidate_probs /= candidate_probs.sum()  # Normalize probabilities.
-
-        # Sample negative items for the user based on their probabilities.
-        sampled_items = np.random.choice(
-            negative_candidates_list, size=num_neg, replace=False, p=candidate_probs
-        )
-
-        return sampled_items
+    # Sorted unique (user << 32 | item) keys of the items each user interacted with
+    user_codes, users = pd.factorize(df[user_col])
+    item_codes = pd.Index(items).get_indexer(df[item_col])
+    positive_keys = np.unique((user_codes.astype(np.int64) << 32) | item_codes)
+    positive_users = positive_keys >> 32
+    positive_mass = np.bincount(
+        positive_users,
+        weights=sampling_probs[positive_keys & 0xFFFFFFFF],
+        minlength=len(users),
+    )
+    n_positives = np.bincount(positive_users, minlength=len(users))
+
+    # The number of negative samples per row is capped by the number of candidates,
+    # users that have interacted with all items are skipped.
+    num_neg = np.minimum(neg_to_pos_ratio, n_items - n_positives[user_codes])
+
+    state = dict(
+        sampling_probs=sampling_probs,
+        sampling_cdf=np.cumsum(sampling_probs) / sampling_probs.sum(),
+        positive_keys=positive_keys,
+        positive_mass=positive_mass,
+        neg_to_pos_ratio=neg_to_pos_ratio,
+    )
+    chunk_starts = range(0, len(df), chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_starts))
+    tasks = [
+        (user_codes[start : start + chunk_size], num_neg[start : start + chunk_size], chunk_seed)
+        for start, chunk_seed in zip(chunk_starts, seeds)
+    ]
+
+    if n_jobs > 1:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=_init_negative_sampler, initargs=(state,)
+        ) as executor:
+            results = executor.map(_sample_negatives_worker, tasks)
+            chunks = list(tqdm(results, total=len(tasks), desc="Negative sampling"))
+    else:
+        chunks = [
+            _sample_negatives_chunk(state, *task)
+            for task in tqdm(tasks, desc="Negative sampling")
+        ]
+    negative_codes = (
+        np.concatenate(chunks)
+        if chunks
+        else np.empty((0, neg_to_pos_ratio), dtype=np.int64)
+    )
 
-    tqdm.pandas()
+    # One output row per negative sample, in the order of the rows of df
+    is_sampled = np.arange(neg_to_pos_ratio)[None, :] < num_neg[:, None]
     df_negative = (
-        df.copy()
-        .assign(
-            negative_samples=lambda df: df.progress_apply(
-                generate_negative_samples_for_user, axis=1
-            ),
-            **{label_col: neg_label}
-        )
-        .explode("negative_samples")
-        .drop(columns=[item_col])
-        .rename(columns={"negative_samples": item_col})[
+        df.iloc[np.repeat(np.arange(len(df)), num_neg)]
+        .assign(**{item_col: items[negative_codes[is_sampled]], label_col: neg_label})[
             [user_col, item_col, label_col, timestamp_col, *features]
         ]
     )
@@ -102,3 +118,98 @@ def generate_negative_samples(
     return df_negative
 
 
+def select_distinct_negatives(chosen, candidates, is_valid, n_needed):
+    """
+    One round of rejection sampling of distinct negatives: fill every row of `chosen` with the
+    valid candidates that are not in the row yet, up to `n_needed` items.
+
+    Args:
+        chosen: Items chosen so far [R, n], -1 in the slots that are still free
+        candidates: Items drawn in this round [R, D]
+        is_valid: Whether each candidate may be chosen [R, D]
+        n_needed: Number of items wanted in each row [R]
+
+    Returns:
+        (chosen [R, n], number of items chosen in each row [R])
+    """
+    # Already chosen items go first so that they are kept
+    pool = np.concatenate([chosen, candidates], axis=1)
+    keep = np.concatenate([chosen >= 0, is_valid], axis=1)
+
+    # Only keep the first occurrence of an item within a row
+    order = np.argsort(pool, axis=1, kind="stable")
+    sorted_pool = np.take_along_axis(pool, order, axis=1)
+    is_first_sorted = np.ones(pool.shape, dtype=bool)
+    is_first_sorted[:, 1:] = sorted_pool[:, 1:] != sorted_pool[:, :-1]
+    is_first = np.empty_like(is_first_sorted)
+    np.put_along_axis(is_first, order, is_first_sorted, axis=1)
+    keep &= is_first
+
+    rank = np.cumsum(keep, axis=1)
+    rows, cols = np.nonzero(keep & (rank <= n_needed[:, None]))
+    chosen = chosen.copy()
+    chosen[rows, rank[rows, cols] - 1] = pool[rows, cols]
+    return chosen, np.minimum(rank[:, -1], n_needed)
+
+
+_negative_sampler_state = None
+
+
+def _init_negative_sampler(state):
+    global _negative_sampler_state
+    _negative_sampler_state = state
+
+
+def _sample_negatives_worker(task):
+    return _sample_negatives_chunk(_negative_sampler_state, *task)
+
+
+def _sample_negatives_chunk(state, user_codes, num_neg, seed, max_rounds=10):
+    """
+    Returns:
+        Item codes [len(user_codes), neg_to_pos_ratio], only the first `num_neg` of each row are set
+    """
+    rng = np.random.default_rng(seed)
+    sampling_probs = state["sampling_probs"]
+    sampling_cdf = state["sampling_cdf"]
+    positive_keys = state["positive_keys"]
+    n_items = len(sampling_probs)
+
+    user_codes = user_codes.astype(np.int64)
+    chosen = np.full((len(user_codes), state["neg_to_pos_ratio"]), -1, dtype=np.int64)
+    n_chosen = np.zeros(len(user_codes), dtype=np.int64)
+    pending = np.flatnonzero(num_neg > 0)
+
+    for _ in range(max_rounds):
+        if len(pending) == 0:
+            break
+        users = user_codes[pending]
+        # Expect to reject the positives share of the probability mass, draw a bit more than that
+        excluded_mass = state["positive_mass"][users].max()
+        n_draws = int(np.ceil(chosen.shape[1] / max(1.0 - excluded_mass, 0.05))) + 2
+
+        candidates = np.searchsorted(
+            sampling_cdf, rng.random((len(pending), n_draws)), side="right"
+        )
+        candidates = np.minimum(candidates, n_items - 1)
+        keys = (users[:, None] << 32) | candidates
+        key_pos = np.minimum(np.searchsorted(positive_keys, keys), len(positive_keys) - 1)
+        is_positive = positive_keys[key_pos] == keys
+
+        chosen[pending], n_chosen[pending] = select_distinct_negatives(
+            chosen[pending], candidates, ~is_positive, num_neg[pending]
+        )
+        pending = pending[n_chosen[pending] < num_neg[pending]]
+
+    for row in pending:
+        # Rare case: the user interacted with most of the popular items,
+        # sample from the renormalized distribution over the negative candidates
+        user = user_codes[row]
+        start, end = np.searchsorted(positive_keys, [user << 32, (user + 1) << 32])
+        candidates = np.setdiff1d(np.arange(n_items), positive_keys[start:end] & 0xFFFFFFFF)
+        candidate_probs = sampling_probs[candidates] / sampling_probs[candidates].sum()
+        chosen[row, : num_neg[row]] = rng.choice(
+            candidates, size=num_neg[row], replace=False, p=candidate_probs
+        )
+
+    return chosen
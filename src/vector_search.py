@@ -35,3 +35,11 @@ class FaissNN:
         )  # Ensure correct shape and dtype
         distances, indices = self.index.search(query_embedding, k)  # Perform the search
         return distances, indices
+
+    def search_batch(self, query_embeddings, k=5):
+
+        query_embeddings = np.ascontiguousarray(
+            query_embeddings, dtype="float32"
+        ).reshape(-1, self.embedding_dim)  # One row per query
+        distances, indices = self.index.search(query_embeddings, k)
+        return distances, indices
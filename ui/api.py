@@ -4,6 +4,7 @@ import time
 from datetime import datetime
 from typing import List
 
+import redis
 import requests
 from loguru import logger
 
@@ -11,6 +12,12 @@ FEAST_ONLINE_SERVER_HOST = os.getenv("FEAST_ONLINE_SERVER_HOST", "feature_online
 FEAST_ONLINE_SERVER_PORT = os.getenv("FEAST_ONLINE_SERVER_PORT", "6566")
 API_HOST = os.getenv("API_HOST", "api")
 API_PORT = os.getenv("API_PORT", "8000")
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+
+# The API drops its cached features of the users published to this channel
+redis_feature_pushed_channel = "feature:user:pushed"
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
 
 def get_recommendations(user_id, top_k_retrieval=100, count=10, debug=False):
 
@@ -47,7 +54,9 @@ def get_user_item_sequence(user_id: str):
                 "accept": "application/json",
             },
             params = {
-                "user_id": user_id
+                "user_id": user_id,
+                # Always read the latest sequence as it is about to be extended and pushed
+                "use_cache": False,
             },
         )
         response.raise_for_status()
@@ -95,4 +104,11 @@ def push_new_item_sequence(
     )
 
     if r.status_code != 200:
-        logger.error(f"Error: {r.status_code} {r.text}")
\ No newline at end of file
+        logger.error(f"Error: {r.status_code} {r.text}")
+        return
+
+    try:
+        redis_client.publish(redis_feature_pushed_channel, user_id)
+    except redis.RedisError as e:
+        # The API still picks up the new features once its cached ones expire
+        logger.error(f"Error publishing to {redis_feature_pushed_channel}: {e}")